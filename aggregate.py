@@ -0,0 +1,83 @@
+"""Counts of answered headlines by source and answer, built in one pass."""
+
+import numpy as np
+
+ANSWERS = ('yes', 'no', 'maybe', 'non-polar')
+
+
+class Cube(object):
+    """A count matrix of headlines, one row per source and column per label.
+
+    Relabelings and selections of columns are matrix operations on
+    the counts and never look at the headlines again.
+    """
+
+    def __init__(self, sources, labels, counts, hlines=None, codes=None):
+        self.sources = tuple(sources)
+        self.labels = tuple(labels)
+        self.counts = counts
+        # the headlines and their label indexes, if built from them
+        self.hlines = hlines
+        self.codes = codes
+
+    @classmethod
+    def from_headlines(cls, hlines, labels=ANSWERS):
+        """Counts hlines by source and answer in one pass."""
+
+        sources = sorted(set(h['source'] for h in hlines))
+        source_index = dict((s, i) for i, s in enumerate(sources))
+        label_index = dict((l, i) for i, l in enumerate(labels))
+        n = len(hlines)
+        source_codes = np.fromiter((source_index[h['source']] for h in hlines),
+                                   np.intp, n)
+        codes = np.fromiter((label_index[h['answer']] for h in hlines),
+                            np.intp, n)
+        counts = np.bincount(source_codes * len(labels) + codes,
+                             minlength=len(sources) * len(labels))
+        return cls(sources, labels,
+                   counts.reshape(len(sources), len(labels)), hlines, codes)
+
+    def project(self, labelmap, labels):
+        """Returns a cube with labels relabeled by labelmap.
+
+        Labels not in labelmap keep their name; counts of labels ending
+        up with the same name are summed. Only the given labels are
+        kept, in that order.
+        """
+
+        m = np.zeros((len(self.labels), len(labels)), self.counts.dtype)
+        index = dict((l, i) for i, l in enumerate(labels))
+        for i, l in enumerate(self.labels):
+            j = index.get(labelmap.get(l, l))
+            if j is not None:
+                m[i, j] = 1
+        return Cube(self.sources, labels, self.counts.dot(m))
+
+    def select(self, labels):
+        """Returns a cube with only the given labels, in that order."""
+
+        return self.project({}, labels)
+
+    def nonempty(self):
+        """Returns a cube without sources that count nothing."""
+
+        keep = self.counts.sum(axis=1) > 0
+        return Cube([s for s, k in zip(self.sources, keep) if k],
+                    self.labels, self.counts[keep])
+
+    def totals(self):
+        """Returns a dict of label to count over all sources."""
+
+        return dict(zip(self.labels, self.counts.sum(axis=0).tolist()))
+
+    def ratios(self):
+        """Returns the counts divided by their source totals."""
+
+        totals = self.counts.sum(axis=1, keepdims=True)
+        return self.counts / np.maximum(totals, 1).astype(float)
+
+    def headlines(self, label):
+        """Returns the headlines counted for label, in input order."""
+
+        i = self.labels.index(label)
+        return [self.hlines[k] for k in np.flatnonzero(self.codes == i)]
@@ -1,4 +1,5 @@
 import sys
+import argparse
 import select
 import tty
 import termios
@@ -7,49 +8,174 @@ import os.path
 import re
 import random
 import cPickle
-import subprocess
 
-import matplotlib.pyplot as plt
+import aggregate
+import classify
+import dedupe
+from journal import Journal
+import render
+import stats
+import store
 
+# answers given since they were last moved to the store
+JOURNAL = 'answers.journal'
 
-def load_headlines():
-    old = []
-    if os.path.exists('headlines.pkl'):
-        old = cPickle.load(open('headlines.pkl'))
+MIN_TRAINING = 50  # answers needed before guessing the others
+ACCEPT_CONFIDENCE = 0.9  # guesses at least this sure can be bulk-accepted
+
+
+def import_states(db):
+    """Copies the articles of all crawler state snapshots to db.
+
+    For stores created after the crawls; crawlers add articles found
+    since their last snapshot when they next run.
+    """
 
-    current = []
     for f in os.listdir('.'):
         if not re.match(r'state_.*Crawler.pkl$', f):
             continue
-        print "Loading", f
+        print "Importing", f
         state = cPickle.load(open(f))
-        for title in state['articles']:
-            if title.endswith('?'):
-                current.append({'title': title,
-                                'source': state['source']})
+        db.update(state['source'],
+                  [(ctitle, title, url)
+                   for ctitle, entries in state['articles'].iteritems()
+                   for title, url in entries])
+
+
+def import_answers(db, fname='headlines.pkl'):
+    """Copies the answers of a headlines pickle to db."""
+
+    print "Importing", fname
+    db.set_answers([(h['source'], h['title'], h['answer'], False)
+                    for h in cPickle.load(open(fname)) if 'answer' in h])
+
 
-    old_titles = set([h['title'] for h in old])
-    current_titles = set([h['title'] for h in current])
+def compact_answers(db, journal):
+    """Moves the answers in journal to db and empties the journal."""
 
-    headlines = [h for h in old if h['title'] in current_titles]
-    headlines.extend([h for h in current if h['title'] not in old_titles])
+    answers = {}
+    for record in journal.replay():
+        if record[0] in ('answer', 'accept'):
+            answers[record[1:3]] = (record[3], record[0] == 'accept')
+    db.set_answers([key + a for key, a in answers.iteritems()])
+    journal.reset()
 
-    print ("Loaded %d headlines, %d old, %d current" %
-           (len(headlines), len(old), len(current)))
+
+def load_headlines():
+    db = store.HeadlineStore()
+    if not db.article_count():
+        import_states(db)
+    if not db.answer_count() and os.path.exists('headlines.pkl'):
+        import_answers(db)
+    # answers of a session that didn't get to save them
+    compact_answers(db, Journal(JOURNAL))
+
+    headlines = db.headlines()
+    db.close()
+
+    print ("Loaded %d headlines, %d answered" %
+           (len(headlines), sum(1 for h in headlines if 'answer' in h)))
 
     return headlines
 
 
-def write_headlines(headlines):
-    f = open('headlines.pkl.tmp', 'w')
-    cPickle.dump(headlines, f)
-    f.close()
-    os.rename('headlines.pkl.tmp', 'headlines.pkl')
+def save_answers(journal):
+    db = store.HeadlineStore()
+    compact_answers(db, journal)
+    db.close()
 
 
-def askloop(questions):
+def _accept(hlines, answer, journal):
+    """Gives hlines answer, as not given by hand."""
+
+    for hline in hlines:
+        hline['answer'] = answer
+        hline['auto'] = True
+        journal.append(('accept', hline['source'], hline['title'], answer))
+
+
+def group_duplicates(questions, journal):
+    """Clusters near-duplicate questions, to ask about them only once.
+
+    Unanswered questions that are near-duplicates of one answered by
+    hand get its answer. Of the others, the first of each set of
+    near-duplicates gets the rest as 'dupes', to be given its answer.
+    Questions are only compared within their cluster, but each pair
+    is checked, as cluster members needn't be near-duplicates of one
+    another. Returns the ids of the questions not to ask about.
+    """
+
+    hasher = dedupe.MinHasher()
+    groups = dedupe.clusters(questions)
+    skip = set()
+    for group in groups:
+        new = [hline for hline in group if 'answer' not in hline]
+        if len(group) < 2 or not new:
+            continue
+        known = [hline for hline in group
+                 if 'answer' in hline and not hline.get('auto')]
+        sigs = dict((id(hline), hasher.signature(hline['title']))
+                    for hline in group)
+
+        def near(a, b):
+            return (dedupe.similarity(sigs[id(a)], sigs[id(b)]) >=
+                    dedupe.THRESHOLD)
+
+        asked = []
+        for hline in new:
+            same = [k for k in known if near(k, hline)]
+            if same:
+                _accept([hline], same[0]['answer'], journal)
+                skip.add(id(hline))
+                continue
+            same = [q for q in asked if near(q, hline)]
+            if same:
+                same[0].setdefault('dupes', []).append(hline)
+                skip.add(id(hline))
+            else:
+                asked.append(hline)
+    journal.sync()
+
+    st = dedupe.stats(groups)
+    print ("%d questions in %d clusters, %d with duplicates "
+           "(%d across sources, largest %d), %d answered from duplicates" %
+           (st['headlines'], st['clusters'], st['with_duplicates'],
+            st['cross_source'], st['largest'],
+            sum(1 for g in groups for h in g if id(h) in skip and
+                'answer' in h)))
+    return skip
+
+
+def accept_guesses(questions, journal, confidence=ACCEPT_CONFIDENCE):
+    """Takes the guesses at least confidence sure as answers.
+
+    Returns the questions left.
+    """
+
+    left = []
+    for hline in questions:
+        if hline.get('confidence', 0) >= confidence:
+            _accept([hline] + hline.get('dupes', []), hline['guess'], journal)
+        else:
+            left.append(hline)
+    journal.sync()
+    return left
+
+
+def askloop(questions, journal):
+    """Asks for answers to questions, journaling each right away.
+
+    If the questions have guesses, these are shown with how likely
+    the questions are polar, and all guesses at least
+    ACCEPT_CONFIDENCE sure can be accepted at once.
+    """
+
+    menu = '[Yes / No / Maybe / Polarity fail / Quit]'
+    guessed = any('guess' in hline for hline in questions)
+    if guessed:
+        menu = '[Yes / No / Maybe / Polarity fail / Accept guesses / Quit]'
     options = ''.join('\x1b[1m' + c + '\x1b[0m' if c.isupper() else c
-                       for c in '[Yes / No / Maybe / Polarity fail / Quit]')
+                       for c in menu)
     stdin_attrs = termios.tcgetattr(sys.stdin)
 
     try:
@@ -58,7 +184,17 @@ def askloop(questions):
         i = 0
         while i < len(questions):
             hline = questions[i]
-            print options, hline['title']
+            info = []
+            if 'guess' in hline:
+                info.append('%s? %.0f%%' % (hline['guess'],
+                                            100 * hline['confidence']))
+                info.append('polar %.0f%%' % (100 * hline['polar']))
+            if hline.get('dupes'):
+                info.append('+%d similar' % len(hline['dupes']))
+            if info:
+                print options, hline['title'], '(%s)' % ', '.join(info)
+            else:
+                print options, hline['title']
 
             c = None
             while True:
@@ -71,8 +207,20 @@ def askloop(questions):
                                    'n': 'no',
                                    'm': 'maybe',
                                    'p': 'non-polar'}[c.lower()]
+                hline.pop('auto', None)
+                journal.append(('answer', hline['source'], hline['title'],
+                                hline['answer']))
+                _accept(hline.get('dupes', []), hline['answer'], journal)
+                journal.sync()
             elif c == 'k':
+                journal.append(('back', hline['source'], hline['title']))
+                journal.sync()
                 i -= 2
+            elif c == 'a' and guessed:
+                left = accept_guesses(questions[i:], journal)
+                print "Accepted %d guesses" % (len(questions) - i - len(left))
+                questions[i:] = left
+                continue
             if c.lower() in ('q', ''):
                 break
 
@@ -81,82 +229,85 @@ def askloop(questions):
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, stdin_attrs)
 
 
-def piechart(hlines, fname, labels, labelmap={}, colormap={}, title=None):
-    count = {}
-    for hline in hlines:
-        a = labelmap.get(hline['answer'], hline['answer'])
-        count[a] = count.get(a, 0) + 1
-
-    plt.clf()
-    if title:
-        plt.suptitle(title)
-    plt.pie([count[l] for l in labels],
-            labels=labels, colors=[colormap[l] for l in labels],
-            autopct='%1.0f%%', startangle=90)
-    plt.axis('equal')
-    plt.savefig(fname, bbox_inches='tight')
-
-
-def stackbar(hlines, fname, labels,
-             labelmap={}, colormap={}, ratio=False, title=''):
-    count = {}
-    for hline in hlines:
-        s = hline['source']
-        a = labelmap.get(hline['answer'], hline['answer'])
-        count.setdefault(s, {}).setdefault(a, 0)
-        count[s][a] += 1
-    if ratio:
-        for s in count:
-            tot = sum(count[s].values())
-            for a in count[s]:
-                count[s][a] /= float(tot)
-
-    plot = """
-           set terminal png
-           set output "%s"
-           set style data histograms
-           set style histogram rowstacked
-           set boxwidth 1 relative
-           set style fill solid 1.0 border -1
-           set yrange [0:%s]
-           set xtic rotate by -45 scale 0
-           set datafile separator "\t"
-           set key left
-           set title "%s"
-           """
-    plot %= (fname, '1.3' if ratio else '*', title)
-    plot += "plot 'stackbar.dat'"
-    for i, l in enumerate(labels):
-        plot += ('%susing %d%s t "%s" linecolor rgb "%s"' %
-                 (' ' if i==0 else ', "" ', i+2,
-                 ':xticlabel(1)' if i==0 else '',
-                  l, colormap[l]))
-    plot += '\n'
-    with open('stackbar.p', 'w') as f:
-        f.write(plot)
-    with open('stackbar.dat', 'w') as f:
-        for s in sorted(count, reverse=True):
-            f.write('%s\t' % s)
-            f.write('\t'.join(map(str, (count[s].get(l, 0) for l in labels))))
-            f.write('\n')
+def piechart(cube, fname, colormap={}, title=None):
+    """Returns a render job for a pie of the totals of cube."""
+
+    count = cube.totals()
+    return (render.piechart,
+            {'fname': fname,
+             'labels': cube.labels,
+             'values': [count[l] for l in cube.labels],
+             'colors': [colormap[l] for l in cube.labels],
+             'title': title})
 
-    subprocess.call(['gnuplot', 'stackbar.p'])
+
+def stackbar(cube, fname, colormap={}, ratio=False, title=''):
+    """Returns a render job for a bar of cube counts per source."""
+
+    cube = cube.nonempty()
+    count = cube.ratios() if ratio else cube.counts
+    return (render.stackbar,
+            {'fname': fname,
+             'sources': cube.sources[::-1],
+             'labels': cube.labels,
+             'counts': count[::-1].tolist(),
+             'colors': [colormap[l] for l in cube.labels],
+             'ratio': ratio,
+             'title': title})
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description='Asks for the answers to headlines phrased as '
+                    'questions, then charts them.')
+    parser.add_argument('redo', nargs='*', metavar='ANSWER',
+                        help="ask again about headlines with these answers, "
+                             "'auto' for accepted guesses")
+    parser.add_argument('--no-guess', action='store_true',
+                        help="don't guess answers from earlier ones")
+    parser.add_argument('--no-report', action='store_true',
+                        help="don't draw charts or write statistics")
+    args = parser.parse_args()
+    for answer in args.redo:
+        if answer not in aggregate.ANSWERS + ('auto',):
+            parser.error('unknown answer %r' % answer)
+
     questions = load_headlines()
 
     random.shuffle(questions)
 
-    redo = sys.argv[1:]
-    unanswered = [hline for hline in questions
-                  if 'answer' not in hline or hline['answer'] in redo]
-
-    print "%d of %d questions unanswered" % (len(unanswered), len(questions))
-
-    askloop(unanswered)
+    journal = Journal(JOURNAL)
+    try:
+        skip = group_duplicates(questions, journal)
+
+        # 'auto' redoes all accepted guesses
+        redo = args.redo
+        unanswered = [hline for hline in questions
+                      if id(hline) not in skip and
+                      ('answer' not in hline or hline['answer'] in redo or
+                       ('auto' in redo and hline.get('auto')))]
+
+        print "%d of %d questions unanswered" % (len(unanswered),
+                                                len(questions))
+
+        # ask about the least certain guesses first
+        training = [hline for hline in questions
+                    if 'answer' in hline and not hline.get('auto')]
+        if len(training) >= MIN_TRAINING and not args.no_guess:
+            model = classify.NaiveBayes().fit(training)
+            unanswered = classify.prelabel(model, unanswered)
+            print ("Guessed answers from %d answers, %d at least %.0f%% sure" %
+                   (len(training),
+                    sum(1 for h in unanswered
+                        if h['confidence'] >= ACCEPT_CONFIDENCE),
+                    100 * ACCEPT_CONFIDENCE))
+
+        askloop(unanswered, journal)
+    finally:
+        save_answers(journal)
 
-    write_headlines(questions)
+    if args.no_report:
+        return 0
 
     answered = [hline for hline in questions if 'answer' in hline]
 
@@ -167,62 +318,72 @@ def main():
               'no': '#ff4444',
               '': '#ffaa44'}
 
+    # one pass over the answers, then every chart is a projection
+    cube = aggregate.Cube.from_headlines(answered)
+    polarity = cube.project({'yes': 'polar',
+                             'no': 'polar',
+                             'maybe': 'polar'},
+                            ['non-polar', 'polar'])
+
+    charts = []
+
     # stacked bar chart of questions per source
-    stackbar(answered, 'betteridge_numbers_stack.png',
-             [''],
-             labelmap={'yes': '',
-                       'no': '',
-                       'maybe': '',
-                       'non-polar': ''},
-             colormap=colors,
-             title='number of headlines phrased as questions, per source')
+    numbers = cube.project(dict.fromkeys(aggregate.ANSWERS, ''), [''])
+    charts.append(stackbar(
+        numbers, 'betteridge_numbers_stack.png',
+        colormap=colors,
+        title='number of headlines phrased as questions, per source'))
 
     # pie chart of polar/non-polar
-    piechart(answered, 'betteridge_polarity_pie.png',
-             ['non-polar', 'polar'],
-             labelmap={'yes': 'polar',
-                       'no': 'polar',
-                       'maybe': 'polar'},
-             colormap=colors,
-             title='polarity of headlines phrased as questions')
+    charts.append(piechart(
+        polarity, 'betteridge_polarity_pie.png',
+        colormap=colors,
+        title='polarity of headlines phrased as questions'))
 
     # stacked bar chart of polar/non-polar per source
-    stackbar(answered, 'betteridge_polarity_stack.png',
-             ['non-polar', 'polar'],
-             labelmap={'yes': 'polar',
-                       'no': 'polar',
-                       'maybe': 'polar'},
-             colormap=colors,
-             title='polarity of headlines phrased as questions, per source')
+    charts.append(stackbar(
+        polarity, 'betteridge_polarity_stack.png',
+        colormap=colors,
+        title='polarity of headlines phrased as questions, per source'))
+
+    answers = cube.select(['non-polar', 'maybe', 'no', 'yes'])
 
     # pie chart of yes/no/maybe/non-polar
-    piechart(answered, 'betteridge_answer_pie.png',
-             ['non-polar', 'maybe', 'no', 'yes'],
-             colormap=colors,
-             title='answers to headlines phrased as questions')
+    charts.append(piechart(
+        answers, 'betteridge_answer_pie.png',
+        colormap=colors,
+        title='answers to headlines phrased as questions'))
 
     # stacked bar chart of yes/no/maybe/non-polar per source
-    stackbar(answered, 'betteridge_answer_stack.png',
-             ['non-polar', 'maybe', 'no', 'yes'],
-             colormap=colors,
-             title='answers to headlines phrased as questions, per source')
-
-    polar = [hline for hline in answered
-             if hline['answer'] in ('yes', 'no', 'maybe')]
+    charts.append(stackbar(
+        answers, 'betteridge_answer_stack.png',
+        colormap=colors,
+        title='answers to headlines phrased as questions, per source'))
 
     # stacked bar chart of yes/no/maybe ratio per source
-    stackbar(polar, 'betteridge_polar_stack.png',
-             ['maybe', 'no', 'yes'],
-             colormap=colors, ratio=True,
-             title='ratio of answers to polar headlines')
+    charts.append(stackbar(
+        cube.select(['maybe', 'no', 'yes']), 'betteridge_polar_stack.png',
+        colormap=colors, ratio=True,
+        title='ratio of answers to polar headlines'))
+
+    # independent charts, so they can be drawn at the same time
+    render.render_all(charts)
+
+    # proportions with confidence intervals, and the verdicts
+    summary = stats.write_report(cube)['overall']
+    if summary['n']:
+        print ("%.0f%% of %d polar answers are no (%.0f%%-%.0f%%), "
+               "verdict: %s" % (100 * summary['no']['share'], summary['n'],
+                                100 * summary['no']['low'],
+                                100 * summary['no']['high'],
+                                summary['verdict']))
 
     # dump the data as text files
     with open('answers.txt', 'w') as f:
         for a in ('yes', 'no', 'maybe', 'non-polar'):
             f.write('%s %s\n' % ('=' * len(a), a.upper()))
-            for hline in answered:
-                if hline['answer'] == a:
-                    f.write('%s (%s)\n' % (hline['title'], hline['source']))
+            for hline in cube.headlines(a):
+                f.write('%s (%s)\n' % (hline['title'], hline['source']))
             f.write('\n')
 
 
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+"""Benchmarks crawlers against a local synthetic news site.
+
+Usage: bench_crawl.py [options] [CRAWLER ...]
+
+A local HTTP proxy serves a generated site in place of every news
+site, with article URLs shaped to match each crawler's rules, a
+random but reproducible link graph, question headlines, slow pages
+and errors. Each crawler then runs in its own process, in an empty
+directory, against its site until it has found the requested number
+of articles. Throughput, CPU time and peak RSS are reported for each.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import urlparse
+
+import crawl
+
+# article URLs matching each crawler's rules, given month m, day d and
+# article number i
+ARTICLE_URLS = {
+    'NYTimesCrawler':
+        'http://www.nytimes.com/2014/%(m)02d/%(d)02d/world/story-%(i)d.html',
+    'BBCCrawler': 'http://www.bbc.com/news/world-%(i)d',
+    'HuffPostCrawler':
+        'http://www.huffingtonpost.com/2014/%(m)02d/%(d)02d/story-%(i)d.html',
+    'DailyMailCrawler':
+        'http://www.dailymail.co.uk/news/article-%(i)07d/story.html',
+    'FoxNewsCrawler':
+        'http://www.foxnews.com/politics/2014/%(m)02d/%(d)02d/story-%(i)d/',
+    'CNNCrawler':
+        'http://www.cnn.com/2014/%(m)02d/%(d)02d/world/story-%(i)d/',
+    'WashingtonPostCrawler': 'http://www.washingtonpost.com/world/'
+                             '2014/%(m)02d/%(d)02d/story-%(i)d.html',
+    'LATimesCrawler': 'http://www.latimes.com/nation/'
+                      'la-na-%(i)d-2014%(m)02d%(d)02d-story.html',
+    'ReutersCrawler':
+        'http://www.reuters.com/article/2014/%(m)02d/%(d)02d/story-%(i)d',
+    'WallStreetJournalCrawler': 'http://online.wsj.com/articles/story-%(i)d',
+    'USATodayCrawler':
+        'http://www.usatoday.com/story/news/2014/%(m)02d/%(d)02d/%(i)d/',
+    'DailyNewsCrawler':
+        'http://www.nydailynews.com/news/story-%(i)d-article-1.%(i)d',
+    'NewYorkPostCrawler':
+        'http://nypost.com/2014/%(m)02d/%(d)02d/story-%(i)d/',
+}
+
+# page title formats the crawlers' cleanup_title expect
+TITLES = {
+    'NYTimesCrawler': '%s - NYTimes.com',
+    'BBCCrawler': 'BBC News - %s',
+    'DailyMailCrawler': '%s | Mail Online',
+    'FoxNewsCrawler': '%s | Fox News',
+    'CNNCrawler': '%s - CNN.com',
+    'WashingtonPostCrawler': '%s - The Washington Post',
+    'LATimesCrawler': '%s - LA Times',
+    'WallStreetJournalCrawler': '%s - WSJ',
+    'DailyNewsCrawler': '%s - NY Daily News',
+    'NewYorkPostCrawler': '%s | New York Post',
+}
+
+WORDS = ('economy', 'election', 'storm', 'market', 'school', 'senator',
+         'vaccine', 'league', 'budget', 'court', 'city', 'robot')
+
+
+def _rng(*key):
+    """Returns a random generator seeded by key, stable across runs."""
+
+    return random.Random(int(hashlib.md5(repr(key)).hexdigest(), 16))
+
+
+class Site(object):
+    """A generated news site for one crawler class.
+
+    Pages are either articles or section hubs, all derived from the
+    seed and the URL alone. A fraction error_rate of pages fails,
+    half with 404 and half with a 503 on the first request only.
+    A fraction alias_rate of links carries a tracking query string,
+    and every page names its plain URL in <link rel="canonical">.
+
+    If feeds is set, robots.txt lists a sitemap index of news sitemaps
+    with the headlines of all articles, sitemap_size per sitemap.
+    """
+
+    def __init__(self, cls, seed, articles, hubs, links, question_rate,
+                 slow_rate, slow_delay, error_rate, alias_rate, feeds=False,
+                 sitemap_size=500):
+        self.cls = cls
+        self.feeds = feeds
+        self.sitemap_size = sitemap_size
+        self.seed = seed
+        self.links = links
+        self.alias_rate = alias_rate
+        self.question_rate = question_rate
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.error_rate = error_rate
+        self.title_format = TITLES.get(cls.__name__, '%s')
+        self.pages = {}
+        for i in range(hubs):
+            url = cls.URL if i == 0 else cls.URL + 'section/%d/' % i
+            self.pages[url] = ('hub', i)
+        self.articles = []
+        for i in range(articles):
+            rng = _rng(seed, cls.__name__, i)
+            url = ARTICLE_URLS[cls.__name__] % {'m': rng.randint(1, 12),
+                                                'd': rng.randint(1, 28),
+                                                'i': 1000000 + i}
+            self.pages[url] = ('article', i)
+            self.articles.append(url)
+        self.hubs = [url for url, (kind, _) in self.pages.items()
+                     if kind == 'hub']
+        self.hubs.sort()
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def _headline(self, url, rng):
+        """Returns (error, headline) of url, advancing rng."""
+
+        kind, i = self.pages[url]
+        error = rng.random() < self.error_rate
+        if kind != 'article':
+            return error, 'Section %d' % i
+        a, b = rng.sample(WORDS, 2)
+        if rng.random() < self.question_rate:
+            return error, 'Will the %s change the %s %d?' % (a, b, i)
+        return error, 'The %s and the %s, part %d' % (a, b, i)
+
+    def feed(self, path):
+        """Returns robots.txt or a sitemap at path, None if none is."""
+
+        if path == 'robots.txt':
+            return 'User-agent: *\nSitemap: %ssitemap.xml\n' % self.cls.URL
+        if path == 'sitemap.xml':
+            out = ['<?xml version="1.0" encoding="UTF-8"?><sitemapindex '
+                   'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+            for i in range(0, len(self.articles), self.sitemap_size):
+                out.append('<sitemap><loc>%ssitemap-%d.xml</loc></sitemap>' %
+                           (self.cls.URL, i / self.sitemap_size))
+            out.append('</sitemapindex>')
+            return ''.join(out)
+        if path.startswith('sitemap-') and path.endswith('.xml'):
+            i = int(path[8:-4]) * self.sitemap_size
+            out = ['<?xml version="1.0" encoding="UTF-8"?><urlset '
+                   'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+                   'xmlns:news='
+                   '"http://www.google.com/schemas/sitemap-news/0.9">']
+            for url in self.articles[i:i + self.sitemap_size]:
+                headline = self._headline(url, _rng(self.seed, url))[1]
+                out.append('<url><loc>%s</loc><news:news><news:title>%s'
+                           '</news:title></news:news></url>' % (url, headline))
+            out.append('</urlset>')
+            return ''.join(out)
+        return None
+
+    def page(self, url):
+        """Returns (status, delay, body) for url."""
+
+        url = url.split('?')[0]
+        if self.feeds and url.startswith(self.cls.URL):
+            feed = self.feed(url[len(self.cls.URL):])
+            if feed is not None:
+                return 200, 0, feed
+        if url not in self.pages:
+            return 404, 0, ''
+        rng = _rng(self.seed, url)
+        error, headline = self._headline(url, rng)
+
+        if error:
+            if rng.random() < 0.5:
+                return 404, 0, ''
+            with self._lock:
+                if url not in self._failed:
+                    self._failed.add(url)
+                    return 503, 0, ''
+        delay = self.slow_delay if rng.random() < self.slow_rate else 0
+        title = self.title_format % headline
+
+        out = ['<html><head><title>%s</title><link rel="canonical" href="%s">'
+               '</head><body>' % (title, url)]
+        for _ in range(self.links):
+            pool = self.hubs if rng.random() < 0.2 else self.articles
+            link = rng.choice(pool)
+            if rng.random() < 0.5:
+                # relative links exercise URL resolution
+                link = urlparse.urlsplit(link).path
+            if rng.random() < self.alias_rate:
+                link += '?utm_source=bench&ref=%d' % rng.randint(1, 9)
+            out.append('<p><a href="%s">%s</a></p>' %
+                       (link, rng.choice(WORDS)))
+        out.append('<a href="http://www.example.com/">elsewhere</a>')
+        out.append('</body></html>')
+        return 200, delay, ''.join(out)
+
+
+class _ProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send each response in one write to avoid Nagle delays
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        parts = urlparse.urlsplit(self.path)
+        site = self.server.sites.get(parts.netloc)
+        if site is None:
+            status, delay, body = 404, 0, ''
+        else:
+            status, delay, body = site.page(self.path)
+        if delay:
+            time.sleep(delay)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # crawlers drop their connections when done
+        pass
+
+
+def serve(sites, ready):
+    """Serves sites through a proxy on a free port, sent to ready."""
+
+    server = _Server(('127.0.0.1', 0), _ProxyHandler)
+    server.sites = dict((urlparse.urlsplit(s.cls.URL).netloc, s)
+                        for s in sites)
+    ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+def run(cls, n, port, seed, verbose):
+    """Crawls with cls in a child process until n articles are found.
+
+    Returns a dict of results.
+    """
+
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        try:
+            d = tempfile.mkdtemp(prefix='bench_crawl_')
+            os.chdir(d)
+            if not verbose:
+                sys.stdout = open(os.devnull, 'w')
+            random.seed(seed)
+            crawl.PROXY = ('127.0.0.1', port)
+            c = cls()
+            before = resource.getrusage(resource.RUSAGE_SELF)
+            start = time.time()
+            c.crawl(n)
+            elapsed = time.time() - start
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            fetches = c.metrics.get('crawler_fetches_total')
+            result = {'crawler': cls.__name__,
+                      'seconds': elapsed,
+                      'fetches': fetches,
+                      'feed_fetches': c.metrics.get(
+                          'crawler_feed_fetches_total'),
+                      'duplicates': c.metrics.get(
+                          'crawler_duplicate_pages_total'),
+                      'articles': len(c.state['articles']),
+                      'pages_per_sec': fetches / elapsed,
+                      'articles_per_sec': len(c.state['articles']) / elapsed,
+                      'cpu_seconds': (after.ru_utime - before.ru_utime +
+                                      after.ru_stime - before.ru_stime),
+                      'peak_rss_kb': after.ru_maxrss}
+            shutil.rmtree(d)
+            os.write(w, json.dumps(result))
+        except Exception:
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+
+    os.close(w)
+    out = []
+    while True:
+        data = os.read(r, 65536)
+        if not data:
+            break
+        out.append(data)
+    os.close(r)
+    os.waitpid(pid, 0)
+    if not out:
+        raise RuntimeError('%s failed' % cls.__name__)
+    return json.loads(''.join(out))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[1].replace('\n', ' '))
+    parser.add_argument('crawlers', nargs='*', metavar='CRAWLER',
+                        help='crawler class names (default: all)')
+    parser.add_argument('-n', '--articles', type=int, default=200,
+                        help='articles to find per crawler')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--site-articles', type=int, default=2000)
+    parser.add_argument('--site-hubs', type=int, default=50)
+    parser.add_argument('--links', type=int, default=40,
+                        help='links per page')
+    parser.add_argument('--question-rate', type=float, default=0.1)
+    parser.add_argument('--slow-rate', type=float, default=0.02)
+    parser.add_argument('--slow-delay', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--alias-rate', type=float, default=0.1,
+                        help='fraction of links with tracking parameters')
+    parser.add_argument('--feeds', action='store_true',
+                        help='serve sitemaps and crawl in discovery mode')
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='HOST_RATE for the crawlers')
+    parser.add_argument('-o', '--output', help='write results as JSON')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='show crawler output')
+    args = parser.parse_args()
+
+    classes = list(crawl.CRAWLERS)
+    if args.crawlers:
+        byname = dict((cls.__name__, cls) for cls in classes)
+        try:
+            classes = [byname[name] for name in args.crawlers]
+        except KeyError, e:
+            parser.error('unknown crawler %s' % e)
+    crawl.HOST_RATE = args.rate
+    crawl.DISCOVERY = args.feeds
+
+    sites = [Site(cls, args.seed, args.site_articles, args.site_hubs,
+                  args.links, args.question_rate, args.slow_rate,
+                  args.slow_delay, args.error_rate, args.alias_rate,
+                  args.feeds) for cls in classes]
+    ready, ready_w = multiprocessing.Pipe(False)
+    server = multiprocessing.Process(target=serve, args=(sites, ready_w))
+    server.daemon = True
+    server.start()
+    port = ready.recv()
+
+    results = []
+    try:
+        for cls in classes:
+            res = run(cls, args.articles, port, args.seed, args.verbose)
+            results.append(res)
+            print ("%-26s %8.1f pages/s %8.1f articles/s %7.2f s CPU "
+                   "%8d kB RSS" % (res['crawler'], res['pages_per_sec'],
+                                   res['articles_per_sec'],
+                                   res['cpu_seconds'],
+                                   res['peak_rss_kb']))
+    finally:
+        server.terminate()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Compares the streaming link extractor with a BeautifulSoup parse.
+
+Usage: bench_extract.py DIR [ROUNDS]
+
+Every file in DIR is treated as a saved HTML page. Each parser runs
+in a forked child process so that peak memory can be measured
+separately for each.
+"""
+
+import os
+import resource
+import sys
+import time
+import traceback
+
+import extract
+
+BASE_URL = 'http://www.example.com/'
+
+
+def parse_stream(page):
+    return extract.extract(extract.decode_page(page), BASE_URL)
+
+
+def parse_soup(page):
+    import BeautifulSoup
+    soup = BeautifulSoup.BeautifulSoup(page)
+    t = soup.find('title')
+    title = t.contents[0] if t and t.contents else 'None'
+    urls = []
+    for a in soup.findAll('a'):
+        if a.has_key('href'):
+            if a['href'].startswith("/"):
+                urls.append(BASE_URL + a['href'][1:])
+            else:
+                urls.append(a['href'])
+    return title, urls
+
+
+def run(parse, pages, rounds):
+    """Parses pages in a child process.
+
+    Returns (seconds, peak RSS growth in kB, total links found).
+    """
+
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        try:
+            sys.setrecursionlimit(10000)
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.time()
+            nlinks = 0
+            for _ in range(rounds):
+                for page in pages:
+                    nlinks += len(parse(page)[1])
+            elapsed = time.time() - start
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(w, '%f %d %d' % (elapsed, peak - before, nlinks))
+        except Exception:
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+
+    os.close(w)
+    out = os.read(r, 1024)
+    os.close(r)
+    os.waitpid(pid, 0)
+    if not out:
+        raise RuntimeError('%s failed' % parse.__name__)
+    elapsed, rss, nlinks = out.split()
+    return float(elapsed), int(rss), int(nlinks)
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print __doc__.strip()
+        return 1
+    rounds = int(sys.argv[2]) if len(sys.argv) == 3 else 1
+
+    pages = []
+    for f in sorted(os.listdir(sys.argv[1])):
+        path = os.path.join(sys.argv[1], f)
+        if os.path.isfile(path):
+            pages.append(open(path, 'rb').read())
+    print "%d pages, %d kB" % (len(pages), sum(map(len, pages)) / 1024)
+
+    for name, parse in (('stream', parse_stream), ('soup', parse_soup)):
+        elapsed, rss, nlinks = run(parse, pages, rounds)
+        print ("%-8s %8.1f pages/sec %8d kB peak RSS growth %8d links" %
+               (name, len(pages) * rounds / elapsed, rss, nlinks / rounds))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
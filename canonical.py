@@ -0,0 +1,73 @@
+"""Maps the many spellings of a URL to a single canonical one."""
+
+import urlparse
+
+# Query parameters that only track where a click came from, stripped
+# from every URL. A trailing '*' matches any parameter with the prefix.
+TRACKING = ('utm_*', 'fbclid', 'gclid', 'dclid', 'mc_cid', 'mc_eid',
+            '_ga', 'ocid', 'ncid', 'cmpid', 'intcmp', 'ns_*', 'WT.*')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def _host_key(host):
+    return host[4:] if host.startswith('www.') else host
+
+
+class Canonicalizer(object):
+    """Rewrites URLs of a site to a canonical form.
+
+    The scheme and host are lowercased, default ports, fragments and
+    empty queries dropped, and an empty path becomes '/'. Links to the
+    host of base with or without 'www.', or with the other of http and
+    https, are rewritten to the scheme and host of base.
+
+    Query parameters in TRACKING or strip are removed, where a trailing
+    '*' matches any parameter with that prefix, and the remaining ones
+    are sorted. If keep is given, all parameters but those in keep are
+    removed instead.
+    """
+
+    def __init__(self, base, strip=(), keep=None):
+        parts = urlparse.urlsplit(base)
+        self.base = base
+        self.scheme = parts.scheme.lower()
+        self.host = parts.netloc.lower()
+        self.origin = '%s://%s/' % (self.scheme, self.host)
+        self.strip = tuple(TRACKING) + tuple(strip)
+        self.keep = None if keep is None else frozenset(keep)
+        self._exact = frozenset(p for p in self.strip if not p.endswith('*'))
+        self._prefixes = tuple(p[:-1] for p in self.strip if p.endswith('*'))
+
+    def _keep_param(self, name):
+        if self.keep is not None:
+            return name in self.keep
+        return name not in self._exact and not name.startswith(self._prefixes)
+
+    def __call__(self, url):
+        # most links are already canonical
+        if url.startswith(self.origin) and '?' not in url and '#' not in url:
+            return url
+
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        port = parts.port
+        if port and port != DEFAULT_PORTS.get(scheme):
+            host = '%s:%d' % (host, port)
+        if parts.username or parts.password:
+            host = parts.netloc.rsplit('@', 1)[0] + '@' + host
+        elif (scheme in DEFAULT_PORTS and
+              _host_key(host) == _host_key(self.host)):
+            scheme, host = self.scheme, self.host
+
+        query = parts.query
+        if query:
+            # compared and kept as sent, without re-encoding
+            params = [p for p in query.split('&')
+                      if p and self._keep_param(p.split('=', 1)[0])]
+            params.sort()
+            query = '&'.join(params)
+
+        return urlparse.urlunsplit((scheme, host, parts.path or '/',
+                                    query, ''))
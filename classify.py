@@ -0,0 +1,86 @@
+"""Guesses answers to headlines from the ones already answered."""
+
+import collections
+import math
+import re
+
+from aggregate import ANSWERS
+
+POLAR = ('yes', 'no', 'maybe')
+
+_word_re = re.compile(r"[a-z0-9']+")
+
+
+def tokens(title):
+    """Returns the words and word pairs of a title."""
+
+    words = _word_re.findall(title.lower())
+    return words + ['%s %s' % pair for pair in zip(words, words[1:])]
+
+
+class NaiveBayes(object):
+    """Multinomial naive Bayes over title words and word pairs.
+
+    Counts are smoothed by adding alpha, so tokens never seen with a
+    label don't rule it out.
+    """
+
+    def __init__(self, labels=ANSWERS, alpha=1.0):
+        self.labels = tuple(labels)
+        self.alpha = alpha
+        self.docs = collections.Counter()
+        self.counts = dict((l, collections.Counter()) for l in self.labels)
+        self.totals = collections.Counter()
+        self.vocabulary = set()
+
+    def fit(self, hlines):
+        """Learns from headlines with answers."""
+
+        for h in hlines:
+            label = h['answer']
+            toks = tokens(h['title'])
+            self.docs[label] += 1
+            self.counts[label].update(toks)
+            self.totals[label] += len(toks)
+            self.vocabulary.update(toks)
+        return self
+
+    def predict(self, title):
+        """Returns a dict of label to probability for a title."""
+
+        n = float(sum(self.docs.values()))
+        v = len(self.vocabulary)
+        toks = [t for t in tokens(title) if t in self.vocabulary]
+        logp = {}
+        for l in self.labels:
+            counts = self.counts[l]
+            denom = math.log(self.totals[l] + self.alpha * v)
+            logp[l] = (math.log((self.docs[l] + self.alpha) /
+                                (n + self.alpha * len(self.labels))) +
+                       sum(math.log(counts[t] + self.alpha) - denom
+                           for t in toks))
+        top = max(logp.values())
+        exp = dict((l, math.exp(p - top)) for l, p in logp.items())
+        total = sum(exp.values())
+        return dict((l, p / total) for l, p in exp.items())
+
+
+def guess(probs):
+    """Returns (answer, confidence, polar probability) for a prediction."""
+
+    answer = max(probs, key=probs.get)
+    return answer, probs[answer], sum(probs.get(l, 0) for l in POLAR)
+
+
+def prelabel(model, hlines):
+    """Sets 'guess', 'confidence' and 'polar' of hlines from model.
+
+    Returns hlines ordered least sure first, for labeling, by the
+    confidence of the guess or, if lower, of whether they're polar.
+    """
+
+    for h in hlines:
+        h['guess'], h['confidence'], h['polar'] = guess(
+            model.predict(h['title']))
+    return sorted(hlines, key=lambda h: min(h['confidence'],
+                                            max(h['polar'], 1 - h['polar'])))
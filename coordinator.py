@@ -0,0 +1,509 @@
+"""Shares the crawls among worker processes, on any number of machines.
+
+A coordinator keeps the state of the crawlers, as crawl.py does, and
+leases batches of URLs to workers. Workers fetch them with the
+crawlers' own rules and report what they found; the coordinator
+dedupes it and counts the articles.
+
+    python coordinator.py serve -w 4 BBC CNN      # coordinator, 4 workers
+    python coordinator.py serve --bind 0.0.0.0    # taking remote workers
+    python coordinator.py work coordhost:8765     # a worker elsewhere
+
+Workers share a secret key with the coordinator, from --authkey or
+$COORDINATOR_AUTHKEY; without one the coordinator makes up a key and
+prints it. Anyone with the key can run code on the coordinator, so
+keep it secret and only bind to interfaces workers can be trusted on.
+"""
+
+import argparse
+import heapq
+import itertools
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import urlparse
+import zlib
+from multiprocessing.managers import BaseManager
+
+import crawl
+import metrics
+import politeness
+from frontier import Frontier
+
+BIND = '127.0.0.1'  # interface to serve on; '' or 0.0.0.0 for all
+PORT = 8765
+AUTHKEY_ENV = 'COORDINATOR_AUTHKEY'  # variable of the shared secret key
+SHARDS = 16  # per crawler
+SHARD_BY = 'host'  # or 'url', letting workers share a host
+BATCH = 50  # URLs per lease
+LEASE_TIME = 60.0  # seconds until an unrenewed lease is reclaimed
+WORKERS = 0  # worker processes started by the coordinator itself
+
+
+def shard(url, shards=SHARDS, by=SHARD_BY):
+    """Returns the shard of url, from the hash of its host or itself."""
+
+    key = urlparse.urlsplit(url).netloc if by == 'host' else url
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return (zlib.crc32(key) & 0xffffffff) % shards
+
+
+class Coordinator(object):
+    """Owns the state of crawlers and leases their URLs to workers.
+
+    The URLs to fetch of each crawler are split into shards, and a
+    shard is leased to one worker at a time, so when sharding by host
+    no two workers fetch from a host for the same crawler at once. A
+    lease that isn't renewed within lease_time is reclaimed and its
+    unreported URLs go back to their shard.
+
+    State is kept as by NewsCrawler.crawl(), in the same snapshot,
+    journal and store, so a crawl can go on in either. Leased URLs
+    stay in url_new until they are reported, and none is lost if the
+    coordinator dies.
+    """
+
+    def __init__(self, crawlers, n, shards=SHARDS, by=SHARD_BY,
+                 batch=BATCH, lease_time=LEASE_TIME):
+        self.crawlers = dict((c.__class__.__name__, c) for c in crawlers)
+        self.names = sorted(self.crawlers)
+        self.n = n
+        self.by = by
+        self.batch = batch
+        self.lease_time = lease_time
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._next = 0      # index in names of the crawler leased next
+        self._shards = {}   # name to a Frontier per shard
+        self._leased = {}   # name to set of leased URLs
+        self._leases = {}   # id to lease, with its deadline
+        self._busy = set()  # (name, shard) of leased shards
+        self._retries = []  # heap of (time, name, url) waiting for a retry
+        self._attempts = {}  # (name, url) to number of failed attempts
+        for name, c in self.crawlers.iteritems():
+            c.prepare()
+            c._sync_state()
+            self._shards[name] = [Frontier() for i in range(shards)]
+            self._leased[name] = set()
+            for url in c.state['url_new']:
+                self._queue(name, url)
+            print ("Coordinating %s, %d new, %d old, %d articles" %
+                   (name, len(c.state['url_new']),
+                    len(c.state['url_visited']), len(c.state['articles'])))
+
+    def _queue(self, name, url):
+        """Adds url to its shard, unless it's leased."""
+
+        if url in self._leased[name]:
+            return
+        shards = self._shards[name]
+        shards[shard(url, len(shards), self.by)].add(
+            url, self.crawlers[name]._priority(url))
+
+    def _take(self, c, frontier):
+        """Pops up to batch URLs to fetch from frontier."""
+
+        url_new = c.state['url_new']
+        urls = []
+        while frontier and len(urls) < self.batch:
+            url = frontier.pop()
+            # visited since it was queued
+            if url not in url_new:
+                continue
+            if not c.may_crawl(url):
+                c._log('visit', url)
+                continue
+            urls.append(url)
+        return urls
+
+    def _end(self, lease_id, reported=()):
+        """Frees a lease, putting its unreported URLs back in shards."""
+
+        lease = self._leases.pop(lease_id, None)
+        if lease is None:
+            return
+        name = lease['source']
+        url_new = self.crawlers[name].state['url_new']
+        self._busy.discard((name, lease['shard']))
+        self._leased[name].difference_update(lease['urls'])
+        for url in lease['urls']:
+            if url not in reported and url in url_new:
+                self._queue(name, url)
+
+    def _reap(self):
+        now = time.time()
+        for lease_id, lease in self._leases.items():
+            if lease['deadline'] < now:
+                print ("Reclaimed lease %d of %s from %s" %
+                       (lease_id, lease['source'], lease['worker']))
+                self._end(lease_id)
+        while self._retries and self._retries[0][0] <= now:
+            _, name, url = heapq.heappop(self._retries)
+            if url in self.crawlers[name].state['url_new']:
+                self._queue(name, url)
+
+    def _done(self, name):
+        """Tells if the crawler called name needs no more fetches."""
+
+        c = self.crawlers[name]
+        if len(c.state['articles']) >= self.n:
+            return True
+        return not (self._leased[name] or any(self._shards[name]) or
+                    any(r[1] == name for r in self._retries))
+
+    def _finished(self):
+        return not self._leases and all(self._done(name)
+                                        for name in self.names)
+
+    def finished(self):
+        """Tells if all crawlers are done and all leases are in."""
+
+        with self._lock:
+            return self._finished()
+
+    def reap(self):
+        """Reclaims expired leases and makes due retries fetchable."""
+
+        with self._lock:
+            self._reap()
+
+    def lease(self, worker):
+        """Leases a batch of URLs of a single shard to worker.
+
+        Returns a dict with the lease id, the source (crawler class
+        name), shard and urls, an empty dict if there's nothing to
+        fetch for now, or None if the crawl is finished.
+        """
+
+        with self._lock:
+            self._reap()
+            for i in range(len(self.names)):
+                name = self.names[(self._next + i) % len(self.names)]
+                c = self.crawlers[name]
+                if len(c.state['articles']) >= self.n:
+                    continue
+                for k, frontier in enumerate(self._shards[name]):
+                    if (name, k) in self._busy or not frontier:
+                        continue
+                    urls = self._take(c, frontier)
+                    if not urls:
+                        continue
+                    # take turns between crawlers
+                    self._next = (self._next + i + 1) % len(self.names)
+                    lease = {'id': next(self._ids), 'source': name,
+                             'shard': k, 'urls': urls}
+                    self._leases[lease['id']] = dict(
+                        lease, worker=worker,
+                        deadline=time.time() + self.lease_time)
+                    self._busy.add((name, k))
+                    self._leased[name].update(urls)
+                    return lease
+            return None if self._finished() else {}
+
+    def renew(self, lease_id):
+        """Extends a lease. Returns False if it was already reclaimed."""
+
+        with self._lock:
+            lease = self._leases.get(lease_id)
+            if lease is None:
+                return False
+            lease['deadline'] = time.time() + self.lease_time
+            return True
+
+    def complete(self, lease, results):
+        """Records the results of a lease and ends it.
+
+        results is a list as returned by results(). URLs of the lease
+        without a result are fetched again later. Results of reclaimed
+        leases are recorded all the same, as recording is idempotent.
+        """
+
+        with self._lock:
+            name = lease['source']
+            c = self.crawlers[name]
+            url_visited = c.state['url_visited']
+            url_new = c.state['url_new']
+            aliases = c.state['aliases']
+            m = c.metrics
+
+            reported = set()
+            for result in results:
+                url = result[1]
+                reported.add(url)
+                m.inc('crawler_fetches_total')
+                if result[0] == 'retry':
+                    m.inc('crawler_retries_total')
+                    key = (name, url)
+                    self._attempts[key] = self._attempts.get(key, 0) + 1
+                    if self._attempts[key] <= crawl.MAX_RETRIES:
+                        heapq.heappush(self._retries, (
+                            time.time() +
+                            politeness.backoff(self._attempts[key]),
+                            name, url))
+                        continue
+                self._attempts.pop((name, url), None)
+                c._log('visit', url)
+                if result[0] != 'page':
+                    continue
+                canonical, article, links = result[2:]
+
+                if canonical is not None:
+                    seen = canonical in url_visited
+                    c._log('alias', url, canonical)
+                    if seen:
+                        # fetched before under another URL
+                        m.inc('crawler_duplicate_pages_total')
+                        continue
+                    url = canonical
+                if article is not None:
+                    m.inc('crawler_article_hits_total')
+                    c._log('article', article[0], article[1], url)
+
+                new = [l for l in set(aliases.get(l, l) for l in links)
+                       if l not in url_visited and l not in url_new]
+                if new:
+                    c._log('links', new)
+                    for l in new:
+                        self._queue(name, l)
+
+            self._end(lease['id'], reported)
+            print ("Crawled %s, %d new, %d old, %d articles" %
+                   (name, len(url_new), len(url_visited),
+                    len(c.state['articles'])))
+
+    def progress(self):
+        """Returns a dict of crawler class name to crawl counts."""
+
+        with self._lock:
+            return dict((name, {'new': len(c.state['url_new']),
+                                'visited': len(c.state['url_visited']),
+                                'articles': len(c.state['articles']),
+                                'leased': len(self._leased[name])})
+                        for name, c in self.crawlers.iteritems())
+
+    def sync(self):
+        """Persists the state of all crawlers, as crawl() does now and then.
+
+        Called from a single thread, as the store can only be used
+        from the thread that opened it.
+        """
+
+        with self._lock:
+            for c in self.crawlers.itervalues():
+                c._sync_state()
+
+    def close(self):
+        """Writes the state snapshots of all crawlers."""
+
+        with self._lock:
+            for c in self.crawlers.itervalues():
+                c._sync_state(compact=True)
+
+
+class CoordinatorManager(BaseManager):
+    """Serves a Coordinator to workers, or connects a worker to it."""
+
+
+def serve(coordinator, address, authkey):
+    """Serves coordinator at address from a background thread."""
+
+    CoordinatorManager.register('coordinator', callable=lambda: coordinator)
+    server = CoordinatorManager(address, authkey).get_server()
+    t = threading.Thread(target=server.serve_forever, name='coordinator')
+    t.daemon = True
+    t.start()
+    return server
+
+
+def connect(address, authkey):
+    """Returns a proxy of the coordinator served at address."""
+
+    CoordinatorManager.register('coordinator')
+    manager = CoordinatorManager(address, authkey)
+    manager.connect()
+    return manager.coordinator()
+
+
+def results(c, fetched):
+    """Turns what NewsCrawler.fetch_many() yielded into lease results.
+
+    Runs the rules of crawler c, so the coordinator doesn't have to.
+    Returns a list of tuples, one per URL, each one of
+    ('retry', url) for transient failures, ('visit', url) for
+    unfetchable URLs, or ('page', url, canonical, article, links).
+    canonical is None unless the page has another crawlable canonical
+    URL, article is None unless the page is an article and else
+    (cleaned up title, title), and links are the crawlable links.
+    """
+
+    out = []
+    for url, title_links in fetched:
+        if title_links is crawl.RETRY:
+            out.append(('retry', url))
+            continue
+        if title_links is None:
+            out.append(('visit', url))
+            continue
+        title, links, canonical = title_links
+        if canonical == url or not c.may_crawl(canonical):
+            canonical = None
+        article = None
+        if c.is_article(canonical or url):
+            article = (c.parser.unescape(c.cleanup_title(title)), title)
+        out.append(('page', url, canonical, article,
+                    c.may_crawl_many(set(links))))
+    return out
+
+
+def work(address, authkey, concurrency=None, per_host=None):
+    """Fetches leased URLs until the coordinator is finished or gone."""
+
+    coordinator = connect(address, authkey)
+    worker = '%s:%d' % (socket.gethostname(), os.getpid())
+    crawlers = {}  # without state, just for their rules
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for c in crawlers.itervalues():
+            c.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    fetched = 0
+    try:
+        while not stopping:
+            lease = coordinator.lease(worker)
+            if lease is None:
+                break
+            if not lease:
+                time.sleep(1.0)
+                continue
+            name = lease['source']
+            if name not in crawlers:
+                crawlers[name] = crawl.crawler_class(name)(state=False)
+            c = crawlers[name]
+            done = c.fetch_many(lease['urls'], concurrency, per_host,
+                                lambda: coordinator.renew(lease['id']))
+            coordinator.complete(lease, results(c, done))
+            fetched += len(lease['urls'])
+    except (EOFError, IOError):
+        # leases of lost workers are reclaimed by the coordinator
+        print "Worker %s lost the coordinator" % worker
+    print "Worker %s done, %d URLs leased" % (worker, fetched)
+
+
+def _local(bind):
+    """Returns the address to reach a coordinator bound to bind from here."""
+
+    return bind if bind not in ('', '0.0.0.0') else '127.0.0.1'
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Shares crawls among workers on many machines.')
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('serve', help='run a coordinator')
+    p.add_argument('sites', nargs='*', metavar='SITE',
+                   help='crawlers to run, by name (default: all)')
+    p.add_argument('-n', '--articles', type=int, default=crawl.ARTICLE_COUNT,
+                   help='articles to find per site')
+    p.add_argument('-b', '--bind', default=BIND,
+                   help='address to serve workers on (default: %(default)s)')
+    p.add_argument('-p', '--port', type=int, default=PORT)
+    p.add_argument('-w', '--workers', type=int, default=WORKERS,
+                   help='worker processes to start on this machine')
+    p.add_argument('--shards', type=int, default=SHARDS,
+                   help='shards per site')
+    p.add_argument('--shard-by', choices=('host', 'url'), default=SHARD_BY)
+    p.add_argument('--batch', type=int, default=BATCH,
+                   help='URLs per lease')
+    p.add_argument('--lease-time', type=float, default=LEASE_TIME,
+                   help='seconds until an unrenewed lease is reclaimed')
+
+    p = commands.add_parser('work', help='run a worker')
+    p.add_argument('address', metavar='HOST:PORT',
+                   help='address of the coordinator')
+
+    for p in commands.choices.values():
+        p.add_argument('--authkey', default=os.environ.get(AUTHKEY_ENV),
+                       help='secret shared by the coordinator and workers '
+                       '(default: $%s)' % AUTHKEY_ENV)
+        p.add_argument('-t', '--threads', type=int, default=crawl.CONCURRENCY,
+                       help='fetches in flight per worker')
+        p.add_argument('--per-host', type=int, default=crawl.PER_HOST,
+                       help='fetches in flight per worker and host')
+        p.add_argument('--rate', type=float, default=crawl.HOST_RATE,
+                       help='fetches per second per worker and host')
+    args = parser.parse_args()
+    crawl.HOST_RATE = args.rate
+
+    if args.command == 'work':
+        if not args.authkey:
+            parser.error('no key, give --authkey or set $%s' % AUTHKEY_ENV)
+        host, _, port = args.address.rpartition(':')
+        work((host or 'localhost', int(port)), args.authkey,
+             args.threads, args.per_host)
+        return 0
+
+    try:
+        names = [crawl.crawler_class(name).__name__
+                 for name in args.sites or
+                 [c.__name__ for c in crawl.CRAWLERS]]
+    except KeyError, e:
+        parser.error('unknown site %s' % e)
+    coordinator = Coordinator([crawl.crawler(name) for name in names],
+                              args.articles, args.shards, args.shard_by,
+                              args.batch, args.lease_time)
+    authkey = args.authkey
+    if not authkey:
+        authkey = os.urandom(16).encode('hex')
+        print "Workers need --authkey %s" % authkey
+    serve(coordinator, (args.bind, args.port), authkey)
+
+    workers = [multiprocessing.Process(
+                   target=work,
+                   args=((_local(args.bind), args.port), authkey,
+                         args.threads, args.per_host))
+               for i in range(args.workers)]
+    for p in workers:
+        p.start()
+    writers = [metrics.MetricsWriter(c.metrics, 'metrics_%s.prom' % name,
+                                     crawl.METRICS_INTERVAL)
+               for name, c in sorted(coordinator.crawlers.items())]
+    for w in writers:
+        w.start()
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        # the workers stop asking once the crawls are finished
+        while not coordinator.finished():
+            time.sleep(1.0)
+            coordinator.reap()
+            coordinator.sync()
+    except KeyboardInterrupt:
+        print "Stopping coordinator"
+        for p in workers:
+            p.terminate()
+    for p in workers:
+        p.join()
+    if coordinator.finished():
+        print "Finished", ', '.join(names)
+    coordinator.close()
+    for w in writers:
+        w.stop()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import random
 import re
+import argparse
 import cPickle
 import os
 import os.path
@@ -12,16 +12,58 @@ import os
 import sys
 import HTMLParser
 import httplib
+import multiprocessing
+import signal
 import threading
-
-import BeautifulSoup
-import mechanize
+import traceback
+import urlparse
+import socket
+import zlib
+import heapq
+import collections
+import hashlib
+import Queue
+
+from canonical import Canonicalizer
+import discover
+import extract
+import httppool
+import metrics
+import politeness
+from frontier import Frontier
+from journal import Journal
+import rules
+from rules import UrlRules
+import store
+import urlset
 
 ARTICLE_COUNT = 2000
 VERBOSE = False
-THREADS = 8
-
-sys.setrecursionlimit(10000)
+PROCESSES = multiprocessing.cpu_count()
+CONCURRENCY = 8  # in-flight fetches per crawler
+PER_HOST = 4     # in-flight fetches per crawler and host
+HOST_RATE = 4.0  # fetches per second per crawler and host
+MAX_RETRIES = 4  # for timeouts, 5xx and other transient failures
+POOL_SIZE = 4    # idle keep-alive connections per crawler and host
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+PROXY = None  # (host, port) of an HTTP proxy to fetch through
+COMPACT_EVERY = 100000  # journal records between state snapshots
+REFILTER_BATCH = 10000  # stored articles re-checked per progress report
+RETRY = object()  # _fetch_worker result for transient failures
+METRICS_INTERVAL = 10.0  # seconds between metrics file writes
+METRICS_PORT = None  # serve metrics on this localhost port if set
+STORE = store.FILENAME  # SQLite headline store, None to not keep one
+DISCOVERY = False  # seed the frontier from sitemaps and feeds
+DISCOVERY_FEEDS = 50  # sitemaps and feeds fetched per crawl, at most
+DAEMON = False  # keep revisiting hubs for new articles after crawling
+MAX_HUBS = 50  # pages revisited per crawler in daemon mode
+HUB_MIN_ARTICLES = 5  # article links making a page a hub
+RECRAWL_MIN = 300  # seconds between revisits of a hub, at least
+RECRAWL_MAX = 6 * 3600  # and at most
+USER_AGENT = ('Mozilla/5.0 (X11; U; Linux i686; en-US; '
+              'rv:1.9.0.1) Gecko/2008071615 Fedora/3.0.'
+              '1-1.fc9 Firefox/3.0.1')
 
 
 class NewsCrawler(object):
@@ -29,160 +71,913 @@ class NewsCrawler(object):
 
     URL = NotImplementedError()
 
-    # Override this
+    # A UrlRules instance, used by the default is_article and may_crawl
+    rules = None
+
+    # A Canonicalizer applied to all links, by default one for URL
+    # stripping only common tracking parameters
+    canonical = None
+
+    # Sitemaps and RSS or Atom feeds read in discovery mode, besides
+    # the sitemaps listed in robots.txt
+    FEEDS = ()
+
+    # Matches the site name in page titles that cleanup_title removes,
+    # if it removes anything; feed titles are only cleaned up if it
+    # matches them
+    TITLE_DECORATION = None
+
+    # Fetch URLs passing is_article() before all others
+    PRIORITIZE = False
+
+    # Keep url_visited as a set of URL fingerprints ('fingerprint') or
+    # in a Bloom filter ('bloom') instead of as a set of strings
+    URL_SET = None
+    BLOOM_ERROR_RATE = 0.001
+
+    # Override this, or set rules
     def is_article(self, url):
-        raise NotImplementedError()
+        if self.rules is None:
+            raise NotImplementedError()
+        return self.rules.is_article(url)
 
     # And probably also this
     def cleanup_title(self, title):
         raise NotImplementedError()
 
     def may_crawl(self, url):
-        raise NotImplementedError()
+        if self.rules is None:
+            raise NotImplementedError()
+        return self.rules.may_crawl(url)
+
+    def may_crawl_many(self, urls):
+        """Returns the urls that may be crawled.
+
+        Uses a single scan over the batch unless may_crawl has been
+        overridden.
+        """
 
-    def __init__(self):
-        self.state = {'url_visited': set(),
-                      'url_new': set([self.URL]),
+        if (self.rules is not None and
+            self.may_crawl.im_func is NewsCrawler.may_crawl.im_func):
+            return self.rules.crawlable(urls)
+        return [url for url in urls if self.may_crawl(url)]
+
+    def is_article_many(self, urls):
+        """Returns the urls that are articles.
+
+        Uses the compiled rules unless is_article has been overridden.
+        """
+
+        if (self.rules is not None and
+            self.is_article.im_func is NewsCrawler.is_article.im_func):
+            return self.rules.articles(urls)
+        return [url for url in urls if self.is_article(url)]
+
+    def article_spec(self):
+        """Returns a description of the current article rules."""
+
+        if (self.rules is not None and
+            self.is_article.im_func is NewsCrawler.is_article.im_func):
+            return self.rules.article_spec()
+        url_re = getattr(self, 'url_re', None)
+        return rules.code_spec(self.is_article,
+                               getattr(url_re, 'pattern', None))
+
+    def __init__(self, state=True):
+        """Loads the crawler state, unless state is False.
+
+        Crawlers without state can only fetch_many(), as for workers
+        of a coordinator that keeps the state.
+        """
+
+        self.state = {'url_visited': self._url_set(),
+                      'url_new': Frontier([self.URL]),
                       'articles': {},
+                      'aliases': {},
+                      'feeds': {},
+                      'hubs': {},
                       'source': self.name}
         self.fname = "state_%s.pkl" % self.__class__.__name__
-        if os.path.exists(self.fname):
+        if state and os.path.exists(self.fname):
             self.state = cPickle.load(open(self.fname))
+        self.state.setdefault('aliases', {})
+        self.state.setdefault('feeds', {})
+        self.state.setdefault('hubs', {})
+        if self.canonical is None:
+            self.canonical = Canonicalizer(self.URL)
+        if not isinstance(self.state['url_new'], Frontier):
+            url_new = Frontier()
+            for url in self.state['url_new']:
+                url_new.add(url, self._priority(url))
+            self.state['url_new'] = url_new
+        if self.URL_SET and isinstance(self.state['url_visited'], set):
+            self.state['url_visited'] = self._url_set(
+                self.state['url_visited'])
+        self._store = None
+        self._unstored = []  # article and drop records not yet in STORE
+        self.journal = Journal("state_%s.journal" % self.__class__.__name__)
+        if state:
+            for record in self.journal.replay():
+                self._apply(record)
         self.parser = HTMLParser.HTMLParser()
+        self._stopping = False
+        self.scheduler = None
+        self.metrics = metrics.Metrics(crawler=self.name)
+        self.pool = httppool.HTTPPool(size=POOL_SIZE,
+                                      connect_timeout=CONNECT_TIMEOUT,
+                                      read_timeout=READ_TIMEOUT,
+                                      headers=[('User-agent', USER_AGENT)],
+                                      proxy=PROXY)
+
+    def _url_set(self, urls=()):
+        """Returns a new set for visited URLs, as configured by URL_SET."""
+
+        if self.URL_SET == 'fingerprint':
+            return urlset.FingerprintSet(urls)
+        if self.URL_SET == 'bloom':
+            return urlset.ScalableBloomFilter(
+                urls, error_rate=self.BLOOM_ERROR_RATE)
+        return set(urls)
+
+    def memory_usage(self):
+        """Returns a dict of the bytes used by each part of the state."""
+
+        usage = {}
+        for key in ('url_visited', 'url_new', 'aliases'):
+            x = self.state[key]
+            if hasattr(x, 'memory_usage'):
+                usage[key] = x.memory_usage()
+            else:
+                usage[key] = urlset.deep_size(x)
+        articles = self.state['articles']
+        usage['articles'] = urlset.deep_size(articles) + sum(
+            urlset.deep_size(entries) + sum(urlset.deep_size(e)
+                                            for e in entries)
+            for entries in articles.itervalues())
+        return usage
+
+    def _priority(self, url):
+        """Tells if url should be fetched before non-priority URLs."""
 
-    def _sync_state(self):
-        """Persists state to disk."""
+        return self.PRIORITIZE and self.is_article(url)
 
+    def _apply(self, record):
+        """Applies a journal record to the state.
+
+        Records are idempotent, so replaying a journal on top of a
+        snapshot that already contains some of them is harmless.
+        """
+
+        url_new = self.state['url_new']
+        url_visited = self.state['url_visited']
+        articles = self.state['articles']
+
+        op = record[0]
+        if op == 'visit':
+            url = record[1]
+            url_new.discard(url)
+            url_visited.add(url)
+        elif op == 'links':
+            for url in record[1]:
+                if url not in url_visited:
+                    url_new.add(url, self._priority(url))
+        elif op == 'article':
+            ctitle, entry = record[1], tuple(record[2:])
+            entries = articles.setdefault(ctitle, [])
+            if entry not in entries:
+                entries.append(entry)
+                self._unstored.append(record)
+        elif op == 'alias':
+            # record[1] was found to be the same page as record[2]
+            url, canonical = record[1:]
+            self.state['aliases'][url] = canonical
+            url_new.discard(canonical)
+            url_visited.add(canonical)
+        elif op == 'feed':
+            self.state['feeds'][record[1]] = record[2]
+        elif op == 'hub':
+            # record[2] is None for pages that are no longer hubs
+            if record[2] is None:
+                self.state['hubs'].pop(record[1], None)
+            else:
+                self.state['hubs'][record[1]] = record[2]
+        elif op == 'rules':
+            self.state['article_rules'] = record[1]
+        elif op == 'drop':
+            ctitle, entry = record[1], tuple(record[2:])
+            entries = articles.get(ctitle, [])
+            if entry in entries:
+                entries.remove(entry)
+                self._unstored.append(record)
+            if ctitle in articles and not entries:
+                articles.pop(ctitle)
+            url_visited.add(entry[1])
+        else:
+            raise ValueError('bad journal record %r' % (record,))
+
+    def _log(self, *record):
+        """Applies a record to the state and appends it to the journal."""
+
+        self._apply(record)
+        self.journal.append(record)
+
+    def _sync_state(self, inflight=(), compact=False):
+        """Persists state to disk.
+
+        Only the journal is flushed, unless it has grown long enough
+        to be compacted into a new state snapshot or compact is set.
+        URLs in inflight have been popped from url_new but not yet
+        visited, and are kept across the compaction.
+
+        Article changes are written to STORE once they are in the
+        journal, and before the snapshot, so none is lost in a crash.
+        """
+
+        with self.metrics.timer('crawler_sync_seconds'):
+            self._sync_or_compact(inflight, compact)
+
+    def _sync_or_compact(self, inflight, compact):
+        self.journal.sync()
+        self._sync_store()
+        if not compact and self.journal.count < COMPACT_EVERY:
+            return
+
+        self.metrics.inc('crawler_compactions_total')
+        # the snapshot must be on disk before the journal goes
         f = open(self.fname + '.tmp', 'w')
         cPickle.dump(self.state, f)
+        f.flush()
+        os.fsync(f.fileno())
         f.close()
         os.rename(self.fname + '.tmp', self.fname)
+        fd = os.open(os.path.dirname(os.path.abspath(self.fname)),
+                     os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.journal.reset()
+        if inflight:
+            self.journal.append(('links', list(inflight)))
+            self.journal.sync()
+
+    def _sync_store(self):
+        """Writes article changes since the last call to STORE."""
+
+        if not STORE or not self._unstored:
+            return
+        if self._store is None:
+            self._store = store.HeadlineStore(STORE)
+        # the last change of each article wins
+        last = {}
+        for record in self._unstored:
+            last[record[3]] = record
+        added = [r[1:] for r in last.itervalues() if r[0] == 'article']
+        dropped = [r[1:] for r in last.itervalues() if r[0] == 'drop']
+        with self.metrics.timer('crawler_store_seconds'):
+            self._store.update(self.name, added, dropped)
+        self._unstored = []
+
+    def _get(self, url, headers=None):
+        """Downloads a URL.
+
+        Returns a httppool.Response, or None if url was somehow
+        unfetchable. Raises politeness.TransientError if fetching url
+        may succeed if retried later.
+        """
+
+        m = self.metrics
+        try:
+            with m.timer('crawler_fetch_seconds'):
+                resp = self.pool.get(url, headers)
+        except httppool.HTTPError, e:
+            m.inc('crawler_fetch_errors_total')
+            if e.status in (408, 429) or e.status >= 500:
+                raise politeness.TransientError(str(e))
+            return None
+        except (httplib.HTTPException, socket.error), e:
+            m.inc('crawler_fetch_errors_total')
+            raise politeness.TransientError(str(e))
+        except (httppool.FetchError, zlib.error):
+            m.inc('crawler_fetch_errors_total')
+            return None
+        m.inc('crawler_downloaded_bytes_total', resp.size)
+        return resp
 
     def _fetch(self, url):
         """Fetches a URL.
 
-        Returns tuple (title, urls) where urls is list of all links
-        found at URL.
+        Returns tuple (title, urls, canonical) where urls is list of
+        all canonicalized links found at URL and canonical is the
+        canonical URL of the page, if it told or redirected to one.
         Returns None if url was somehow unfetchable.
+        Raises politeness.TransientError if fetching url may succeed
+        if retried later.
         """
 
-        br = mechanize.Browser()
-        br.set_handle_robots(False)
-        br.set_handle_refresh(False)
-        br.addheaders = [('User-agent',
-                          ('Mozilla/5.0 (X11; U; Linux i686; en-US; '
-                           'rv:1.9.0.1) Gecko/2008071615 Fedora/3.0.'
-                           '1-1.fc9 Firefox/3.0.1'))]
-        try:
-            page = br.open(url).read()
-        except (mechanize.HTTPError,
-                mechanize.URLError,
-                mechanize.BrowserStateError,
-                httplib.BadStatusLine):
+        resp = self._get(url)
+        if resp is None:
             return None
-
-        soup = BeautifulSoup.BeautifulSoup(page)
-        t = soup.find('title')
-        title = t.contents[0] if t and t.contents else 'None'
-        urls = []
-        for a in soup.findAll('a'):
-            if a.has_key('href'):
-                if a['href'].startswith("/"):
-                    urls.append(self.URL + a['href'][1:])
-                else:
-                    urls.append(a['href'])
+        title, urls, canonical = self._parse(resp)
+        if title is None:
+            title = 'None'
         if not title.strip:
             return None
-        return (title.strip(), urls)
+        return (title.strip(), urls, canonical)
 
-    def crawl(self, n):
-        """Crawls the site until n articles have been found."""
+    def _parse(self, resp):
+        """Returns (title, urls, canonical) of a page, as for _fetch()."""
+
+        with self.metrics.timer('crawler_parse_seconds'):
+            page = extract.decode_page(resp.body,
+                                       resp.headers.get('content-type'))
+            title, urls, canonical = extract.extract(page, resp.url)
+            urls = [u for u in map(self._canonical, urls) if u is not None]
+            canonical = ((canonical and self._canonical(canonical)) or
+                         self.canonical(resp.url))
+        return title, urls, canonical
+
+    def _canonical(self, url):
+        """Returns the canonical form of url, or None if it's malformed."""
+
+        try:
+            return self.canonical(url)
+        except ValueError:
+            # like a bad port or an unclosed IPv6 address
+            self.metrics.inc('crawler_bad_links_total')
+            return None
+
+    def stop(self):
+        """Makes a running crawl() sync its state and return early.
+
+        Safe to call from a signal handler.
+        """
+
+        self._stopping = True
+
+    def _refilter(self):
+        """Drops stored articles that no longer pass is_article.
+
+        Only runs when the article rules have changed since the last
+        run, and then only on the articles the change may affect.
+        """
 
-        url_new = self.state['url_new']
-        url_visited = self.state['url_visited']
         articles = self.state['articles']
+        spec = self.article_spec()
+        scope = rules.refilter_scope(self.state.get('article_rules'), spec)
+        if scope is None:
+            return
 
-        # retroactively apply article filter in case it has changed
+        todo = [(ctitle, title, url)
+                for ctitle, entries in articles.iteritems()
+                for title, url in entries if scope(url)]
         numrem_art, numrem_url = 0, 0
-        for ctitle in articles:
-            remove = []
-            for i, (_, url) in enumerate(articles[ctitle]):
-                if not self.is_article(url):
-                    remove.append(i)
-                    url_visited.add(url)
-            for i in reversed(remove):
-                url_visited.add(articles[ctitle].pop(i)[1])
-                numrem_url += 1
-        for ctitle in articles.keys():
-            if not articles[ctitle]:
-                articles.pop(ctitle)
-                numrem_art += 1
+        for i in range(0, len(todo), REFILTER_BATCH):
+            batch = todo[i:i + REFILTER_BATCH]
+            keep = set(self.is_article_many([url for _, _, url in batch]))
+            for ctitle, title, url in batch:
+                if url not in keep:
+                    self._log('drop', ctitle, title, url)
+                    numrem_url += 1
+                    if ctitle not in articles:
+                        numrem_art += 1
+            if len(todo) > REFILTER_BATCH:
+                print ("Re-filtered %s, %d of %d articles" %
+                       (self.__class__.__name__,
+                        min(i + REFILTER_BATCH, len(todo)), len(todo)))
+        self._log('rules', spec)
+
         if numrem_url:
             print ("Removed %d urls and %d articles from %s" %
                    (numrem_url, numrem_art, self.__class__.__name__))
 
-        if len(articles) >= n:
+    def prepare(self):
+        """Brings the state up to date before crawling."""
+
+        # articles found before there was a store
+        articles = self.state['articles']
+        if STORE and not self.state.get('stored'):
+            self._unstored.extend(('article', ctitle) + entry
+                                  for ctitle, entries in articles.iteritems()
+                                  for entry in entries)
+            self.state['stored'] = True
+
+        # retroactively apply article filter in case it has changed
+        self._refilter()
+
+    def _get_politely(self, url, headers=None):
+        """Downloads a URL outside of crawl(), through the scheduler.
+
+        Returns a httppool.Response, or None if it couldn't be fetched.
+        """
+
+        host = urlparse.urlsplit(url).netloc
+        while not self.scheduler.acquire(host, timeout=1.0):
+            if self._stopping:
+                return None
+        resp, ok = None, True
+        start = time.time()
+        try:
+            resp = self._get(url, headers)
+        except politeness.TransientError:
+            ok = False
+        finally:
+            self.scheduler.release(host, time.time() - start, ok)
+        return resp
+
+    def _get_feed(self, url):
+        """Downloads a sitemap, feed or robots.txt, politely."""
+
+        self.metrics.inc('crawler_feed_fetches_total')
+        return self._get_politely(url)
+
+    def _discover(self, n):
+        """Seeds the frontier from sitemaps and feeds.
+
+        Reads FEEDS and the sitemaps listed in robots.txt, and the
+        sitemaps these list in turn, up to DISCOVERY_FEEDS documents or
+        until n articles have been found. Listed sitemaps whose lastmod
+        hasn't changed since they were last read are skipped.
+
+        Articles whose title is in the feed are stored without fetching
+        the page. All other crawlable URLs are added to the frontier.
+        """
+
+        url_visited = self.state['url_visited']
+        articles = self.state['articles']
+        aliases = self.state['aliases']
+        feeds = self.state['feeds']
+        m = self.metrics
+
+        todo = collections.deque(self.FEEDS)
+        robots = self._get_feed(urlparse.urljoin(self.URL, '/robots.txt'))
+        if robots is not None:
+            todo.extend(discover.robots_sitemaps(robots.body))
+        seen = set(todo)
+        lastmods = {}  # of listed sitemaps in todo
+        fetched = found = 0
+
+        while (todo and fetched < DISCOVERY_FEEDS and len(articles) < n and
+               not self._stopping):
+            feed = todo.popleft()
+            fetched += 1
+            resp = self._get_feed(feed)
+            if resp is None:
+                continue
+
+            new = set()
+            try:
+                for e in discover.parse(resp.body):
+                    if e.is_feed:
+                        changed = (e.lastmod is None or
+                                   feeds.get(e.url) != e.lastmod)
+                        if changed and e.url not in seen:
+                            seen.add(e.url)
+                            lastmods[e.url] = e.lastmod
+                            todo.append(e.url)
+                        continue
+                    url = self._canonical(e.url)
+                    url = aliases.get(url, url)
+                    if (url is None or url in url_visited or
+                        not self.may_crawl(url)):
+                        continue
+                    if e.title and self.is_article(url):
+                        # feed titles mostly lack the site name, and
+                        # cleaning them up would cut them short
+                        raw_title = title = e.title.strip()
+                        if (self.TITLE_DECORATION is not None and
+                            self.TITLE_DECORATION.search(title)):
+                            title = self.cleanup_title(title)
+                        ctitle = self.parser.unescape(title)
+                        if ctitle.strip():
+                            self._log('visit', url)
+                            self._log('article', ctitle, raw_title, url)
+                            m.inc('crawler_feed_articles_total')
+                            found += 1
+                            continue
+                    new.add(url)
+            except discover.ParseError:
+                m.inc('crawler_feed_errors_total')
+            new.difference_update(self.state['url_new'])
+            if new:
+                self._log('links', list(new))
+            if lastmods.get(feed):
+                self._log('feed', feed, lastmods[feed])
+
+        print ("Discovered %s, %d feeds read, %d articles, %d to crawl" %
+               (self.__class__.__name__, fetched, found,
+                len(self.state['url_new'])))
+
+    def _fetch_worker(self, todo, done, scheduler):
+        """Fetches URLs from todo until None is received.
+
+        Puts (url, title_links) on done for every URL, where
+        title_links is the return value of _fetch(), or RETRY if
+        fetching failed but may succeed later.
+        """
+
+        while True:
+            url = todo.get()
+            if url is None:
+                return
+            host = urlparse.urlsplit(url).netloc
+            while not scheduler.acquire(host, timeout=1.0):
+                if self._stopping:
+                    break
+            else:
+                title_links, ok = None, True
+                start = time.time()
+                try:
+                    title_links = self._fetch(url)
+                except politeness.TransientError:
+                    title_links, ok = RETRY, False
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    scheduler.release(host, time.time() - start, ok)
+                done.put((url, title_links))
+                continue
+            done.put((url, RETRY))
+
+    def fetch_many(self, urls, concurrency=None, per_host=None, tick=None):
+        """Fetches urls politely, without touching the state.
+
+        Yields (url, title_links) as _fetch_worker() puts them on its
+        done queue, in no particular order. URLs not yet fetched when
+        stop() is called are left out. tick, if given, is called about
+        once a second while waiting for fetches. concurrency and
+        per_host default to CONCURRENCY and PER_HOST.
+        """
+
+        concurrency = concurrency or CONCURRENCY
+        per_host = per_host or PER_HOST
+        if self.scheduler is None:
+            self.scheduler = politeness.HostScheduler(
+                rate=HOST_RATE, burst=per_host, max_concurrency=per_host)
+        todo, done = Queue.Queue(), Queue.Queue()
+        for url in urls:
+            todo.put(url)
+        workers = min(concurrency, todo.qsize())
+        for i in range(workers):
+            todo.put(None)
+            t = threading.Thread(target=self._fetch_worker,
+                                 args=(todo, done, self.scheduler),
+                                 name='%s-fetch-%d' % (
+                                     self.__class__.__name__, i))
+            t.daemon = True
+            t.start()
+
+        left = len(urls)
+        ticked = time.time()
+        while left and not self._stopping:
+            if tick is not None and time.time() - ticked >= 1.0:
+                tick()
+                ticked = time.time()
+            try:
+                result = done.get(timeout=1.0)
+            except Queue.Empty:
+                continue
+            left -= 1
+            yield result
+
+    def crawl(self, n, concurrency=None, per_host=None, urls=None):
+        """Crawls the site until n articles have been found.
+
+        Up to concurrency URLs are fetched at the same time, but never
+        more than per_host from any single host, and at most HOST_RATE
+        per second. Fetches failing with transient errors are retried
+        with backoff, up to MAX_RETRIES times. All state updates happen
+        in the calling thread.
+
+        If urls is given, only those are fetched, without following
+        their links, and n may be None. concurrency and per_host
+        default to CONCURRENCY and PER_HOST.
+        """
+
+        concurrency = concurrency or CONCURRENCY
+        per_host = per_host or PER_HOST
+
+        url_new = self.state['url_new']
+        url_visited = self.state['url_visited']
+        articles = self.state['articles']
+        aliases = self.state['aliases']
+        frontier = url_new if urls is None else Frontier(urls)
+
+        if urls is None:
+            self._stopping = False
+
+        self.prepare()
+
+        if n is not None and len(articles) >= n:
+            self._sync_state()
             return
 
         print ("Crawling %s, %d new, %d old, %d articles" %
                (self.__class__.__name__,
-                len(url_new), len(url_visited), len(articles)))
+                len(frontier), len(url_visited), len(articles)))
+
+        self.scheduler = politeness.HostScheduler(rate=HOST_RATE,
+                                                  burst=per_host,
+                                                  max_concurrency=per_host)
+        m = self.metrics
+        writer = metrics.MetricsWriter(
+            m, 'metrics_%s.prom' % self.__class__.__name__, METRICS_INTERVAL)
+        todo, done = Queue.Queue(), Queue.Queue()
+        workers = []
+        inflight = set()
+        retries = []   # heap of (time, url) of URLs waiting for a retry
+        attempts = {}  # url to number of failed attempts
+        writer.start()
+        try:
+            if DISCOVERY and urls is None:
+                self._discover(n)
+
+            for i in range(concurrency):
+                t = threading.Thread(target=self._fetch_worker,
+                                     args=(todo, done, self.scheduler),
+                                     name='%s-fetch-%d' % (
+                                         self.__class__.__name__, i))
+                t.daemon = True
+                t.start()
+                workers.append(t)
+
+            while ((n is None or len(articles) < n) and
+                   not self._stopping):
+
+                # keep the fetchers busy, retries first
+                now = time.time()
+                while (retries and retries[0][0] <= now and
+                       len(inflight) < concurrency):
+                    url = heapq.heappop(retries)[1]
+                    inflight.add(url)
+                    todo.put(url)
+                while frontier and len(inflight) < concurrency:
+                    url = frontier.pop()
+                    if not self.may_crawl(url):
+                        self._log('visit', url)
+                        continue
+                    inflight.add(url)
+                    todo.put(url)
+
+                # without new URLs to fetch, we're dead in the water
+                if not inflight and not retries:
+                    if urls is None:
+                        print "EEEEEEEK, ran out of URLs!"
+                    break
 
-        while len(articles) < n:
+                # time out now and then to let signal handlers run and
+                # retries become due
+                try:
+                    url, title_links = done.get(timeout=1.0)
+                except Queue.Empty:
+                    continue
+                inflight.remove(url)
+                m.inc('crawler_fetches_total')
+                if title_links is RETRY:
+                    m.inc('crawler_retries_total')
+                    attempts[url] = attempts.get(url, 0) + 1
+                    if attempts[url] <= MAX_RETRIES:
+                        heapq.heappush(retries, (
+                            time.time() + politeness.backoff(attempts[url]),
+                            url))
+                        continue
+                    title_links = None
+                attempts.pop(url, None)
+                if title_links is None:
+                    self._log('visit', url)
+                    continue
+                title, links, canonical = title_links
+
+                # mark as visited, under the canonical URL too
+                self._log('visit', url)
+                if canonical != url and self.may_crawl(canonical):
+                    seen = canonical in url_visited
+                    self._log('alias', url, canonical)
+                    if seen:
+                        # fetched before under another URL
+                        m.inc('crawler_duplicate_pages_total')
+                        continue
+                    url = canonical
+
+                # possibly add to set of articles
+                ctitle = self.parser.unescape(self.cleanup_title(title))
+                if self.is_article(url):
+                    m.inc('crawler_article_hits_total')
+                    self._log('article', ctitle, title, url)
+
+                if VERBOSE:
+                    print '-' * 30
+                    print ctitle
+                    print title
+                    print url
+                    print self.is_article(url)
+
+                # pull out all relevant links at them to the todo
+                with m.timer('crawler_filter_seconds'):
+                    new = set()
+                    links = self.may_crawl_many(
+                        set(aliases.get(l, l) for l in links))
+                    for l in links:
+                        if (l not in url_visited and l not in url_new and
+                            l not in inflight and l not in attempts):
+                            new.add(l)
+                if urls is None:
+                    if new:
+                        self._log('links', list(new))
+                    if DAEMON and not self.is_article(url):
+                        self._track_hub(url, links)
+
+                m.set('crawler_frontier_urls', len(frontier))
+                m.set('crawler_visited_urls', len(url_visited))
+                m.set('crawler_articles', len(articles))
+                m.set('crawler_article_hit_ratio',
+                      m.get('crawler_article_hits_total') /
+                      float(m.get('crawler_fetches_total')))
+
+                # periodic state sync
+                if len(url_visited) % 100 == 9:
+                    self._sync_state(inflight.union(attempts))
+
+                    print ("Crawled %s, %d new, %d old, %d articles" %
+                           (self.__class__.__name__,
+                            len(frontier),
+                            len(url_visited),
+                            len(articles)))
+        finally:
+            # unfinished fetches are abandoned, their URLs go back to url_new
+            for t in workers:
+                todo.put(None)
+            unfinished = inflight.union(url for _, url in retries)
+            if urls is None:
+                for url in unfinished:
+                    url_new.add(url, self._priority(url))
+            else:
+                # recrawled URLs were never journaled as links, so the
+                # ones left over are, to be fetched by the next crawl
+                unfinished.update(frontier)
+                if unfinished:
+                    self._log('links', list(unfinished))
+            writer.stop()
+
+        # recrawls are small, and are left to the journal
+        self._sync_state(compact=urls is None)
+        # with the time of the final sync
+        m.write(writer.fname)
+
+        stats = self.pool.stats()
+        print ("Connections for %s, %d requests, %d opened, %d reused" %
+               (self.__class__.__name__, stats['requests'],
+                stats['connections'], stats['reused']))
+        if VERBOSE:
+            print "Memory for %s, %s" % (
+                self.__class__.__name__,
+                ', '.join('%s %d kB' % (k, v / 1024) for k, v in
+                          sorted(self.memory_usage().items())))
+
+    def _new_hub(self, score):
+        return {'score': score, 'interval': RECRAWL_MIN, 'due': 0,
+                'etag': None, 'modified': None, 'hash': None}
+
+    def _track_hub(self, url, links):
+        """Keeps url as a hub if it links to enough articles.
+
+        Only the MAX_HUBS pages linking to the most articles are kept,
+        besides URL.
+        """
 
-            # without new URLs to fetch, we're dead in the water
-            if not url_new:
-                print "EEEEEEEK, ran out of URLs!"
-                break
+        hubs = self.state['hubs']
+        score = len(self.is_article_many(links))
+        if score < HUB_MIN_ARTICLES or url in hubs:
+            return
+        if len(hubs) >= MAX_HUBS:
+            worst = min((h for h in hubs if h != self.URL),
+                        key=lambda h: hubs[h]['score'])
+            if hubs[worst]['score'] >= score:
+                return
+            self._log('hub', worst, None)
+        self._log('hub', url, self._new_hub(score))
+
+    def _seed_hubs(self, per_host=None):
+        """Tracks the hubs among the pages URL links to.
+
+        For crawlers that found their articles before daemon mode, and
+        so never saw the section pages while crawling.
+        """
 
-            # fetch a random URL
-            url = random.choice(tuple(url_new))
-            title_links = self._fetch(url)
-            if title_links is None or not self.may_crawl(url):
-                url_new.remove(url)
-                url_visited.add(url)
-                continue
-            title, links = title_links
+        self.scheduler = None
+        aliases = self.state['aliases']
+        links = set()
+        for url, title_links in self.fetch_many([self.URL],
+                                                per_host=per_host):
+            if title_links not in (None, RETRY):
+                links = set(aliases.get(l, l) for l in title_links[1])
+        links.discard(self.URL)
+        links = self.may_crawl_many(links)
+        articles = set(self.is_article_many(links))
+        pages = sorted(l for l in links if l not in articles)[:4 * MAX_HUBS]
+        for url, title_links in self.fetch_many(pages, per_host=per_host):
+            if title_links not in (None, RETRY):
+                _, links, canonical = title_links
+                links = self.may_crawl_many(
+                    set(aliases.get(l, l) for l in links))
+                self._track_hub(canonical if self.may_crawl(canonical)
+                                else url, links)
+        self._sync_state()
 
-            # mark as visited and possibly add to set of articles
-            ctitle = self.parser.unescape(self.cleanup_title(title))
-            url_new.remove(url)
-            url_visited.add(url)
-            if self.is_article(url):
-                articles.setdefault(ctitle, []).append((title, url))
-
-            if VERBOSE:
-                print '-' * 30
-                print ctitle
-                print title
-                print url
-                print self.is_article(url)
-
-            # pull out all relevant links at them to the todo
-            for l in links:
-                if l not in url_visited and self.may_crawl(l):
-                    url_new.add(l)
-
-            # periodic state sync
-            if len(url_visited) % 100 == 9:
-                self._sync_state()
-
-                print ("Crawled %s, %d new, %d old, %d articles" %
-                       (self.__class__.__name__,
-                        len(url_new),
-                        len(url_visited),
-                        len(articles)))
+    def recrawl(self, per_host=None):
+        """Revisits the hubs that are due and fetches their new articles.
 
-        self._sync_state()
+        Hubs are fetched with a conditional GET, and a page whose body
+        hashes the same as last time isn't parsed. A hub is revisited
+        twice as soon after it changed and 1.5 times later after it
+        didn't, within RECRAWL_MIN and RECRAWL_MAX seconds. per_host
+        defaults to PER_HOST.
+
+        Returns the seconds until the next hub is due.
+        """
+
+        per_host = per_host or PER_HOST
+        hubs = self.state['hubs']
+        url_visited = self.state['url_visited']
+        aliases = self.state['aliases']
+        m = self.metrics
+        if self.URL not in hubs:
+            self._log('hub', self.URL, self._new_hub(float('inf')))
+        self.scheduler = politeness.HostScheduler(rate=HOST_RATE,
+                                                  burst=per_host,
+                                                  max_concurrency=per_host)
+
+        new = set()
+        for url, hub in sorted(hubs.items()):
+            if hub['due'] > time.time() or self._stopping:
+                continue
+            headers = {}
+            if hub['etag']:
+                headers['If-None-Match'] = hub['etag']
+            if hub['modified']:
+                headers['If-Modified-Since'] = hub['modified']
+            m.inc('crawler_recrawl_fetches_total')
+            resp = self._get_politely(url, headers)
+
+            hub = dict(hub)
+            changed = False
+            if resp is None:
+                pass
+            elif resp.status == 304:
+                m.inc('crawler_recrawl_unmodified_total')
+            else:
+                hub['etag'] = resp.headers.get('etag')
+                hub['modified'] = resp.headers.get('last-modified')
+                digest = hashlib.sha1(resp.body).hexdigest()
+                if digest == hub['hash']:
+                    m.inc('crawler_recrawl_unchanged_total')
+                else:
+                    changed = True
+                    hub['hash'] = digest
+                    links = set(aliases.get(l, l)
+                                for l in self._parse(resp)[1])
+                    for l in self.is_article_many(self.may_crawl_many(links)):
+                        if l not in url_visited:
+                            new.add(l)
+            hub['interval'] = min(RECRAWL_MAX, max(
+                RECRAWL_MIN, hub['interval'] * (0.5 if changed else 1.5)))
+            hub['due'] = time.time() + hub['interval']
+            self._log('hub', url, hub)
+
+        if new:
+            m.inc('crawler_recrawl_articles_total', len(new))
+            self.crawl(None, per_host=per_host, urls=new)
+        else:
+            self._sync_state()
+        return min(hub['due'] for hub in hubs.values()) - time.time()
+
+    def daemon(self):
+        """Recrawls hubs as they become due, until stop() is called."""
+
+        # the crawl may have ended before it saw any hub
+        if len(self.state['hubs']) <= 1:
+            self._seed_hubs()
+        print "Recrawling %s, %d hubs" % (self.__class__.__name__,
+                                          len(self.state['hubs']))
+        while not self._stopping:
+            deadline = time.time() + self.recrawl()
+            # short sleeps keep stop() responsive
+            while not self._stopping and time.time() < deadline:
+                time.sleep(min(1.0, max(0, deadline - time.time())))
+        self._sync_state(compact=True)
 
 
 class NYTimesCrawler(NewsCrawler):
     URL = "http://www.nytimes.com/"
     url_re = re.compile(r'http://.*nytimes\.com/20[01][0-9]/[0-9]{2}/[0-9]{2}.*')
     name = 'NYTimes'
-
-    def is_article(self, url):
-        return bool(self.url_re.match(url)) and '.blogs.' not in url
+    canonical = Canonicalizer(URL, strip=['_r', 'hp', 'ref', 'src', 'smid',
+                                          'action', 'module', 'region',
+                                          'pgtype', 'emc', 'partner'])
+    rules = UrlRules(allow=['nytimes.com'],
+                     article=url_re,
+                     article_deny=['.blogs.'])
+    TITLE_DECORATION = re.compile(r' - (The New York Times|NYTimes\.com)$')
 
     def cleanup_title(self, title):
         i =  title.rfind(u'-')
@@ -190,87 +985,79 @@ class NYTimesCrawler(NewsCrawler):
             title = title[:i].strip()
         return title
 
-    def may_crawl(self, url):
-        return 'nytimes.com' in url
-
 
 class BBCCrawler(NewsCrawler):
     URL = "http://www.bbc.com/"
     url_re = re.compile(r'http://www\.bbc\.(com|co\.uk)/news/.*[0-9]+')
     name = 'BBC'
-
-    def is_article(self, url):
-        x = bool(self.url_re.match(url))
-        return x and not url.endswith('default.stm') and '/blogs-' not in url
+    canonical = Canonicalizer(URL, strip=['ocid', 'at_*'])
+    rules = UrlRules(allow=['bbc'],
+                     deny=['shop.bbc',
+                           'stumbleupon',
+                           'google.com',
+                           'linkedin',
+                           'twitter.com',
+                           'facebook.com',
+                           'digg.com',
+                           '/programmes/',
+                           'reddit.com',
+                           '/cbeebies/',
+                           'ssl.bbc',
+                           '/comments/',
+                           '/sport/',
+                           '/music/',
+                           'downloads.bbc'],
+                     article=url_re,
+                     article_deny=['/blogs-'],
+                     article_deny_suffix=['default.stm'])
+    TITLE_DECORATION = re.compile(r'^BBC News - ')
 
     def cleanup_title(self, title):
         return ''.join(title.split('-')[1:]).strip()
 
-    def may_crawl(self, url):
-        return ('bbc' in url and
-                'shop.bbc' not in url and
-                'stumbleupon' not in url and
-                'google.com' not in url and
-                'linkedin' not in url and
-                'twitter.com' not in url and
-                'facebook.com' not in url and
-                'digg.com' not in url and
-                '/programmes/' not in url and
-                'reddit.com' not in url and
-                '/cbeebies/' not in url and
-                'ssl.bbc' not in url and
-                '/comments/' not in url and
-                '/sport/' not in url and
-                '/music/' not in url and
-                'downloads.bbc' not in url)
-
 
 class HuffPostCrawler(NewsCrawler):
     URL = "http://www.huffingtonpost.com/"
     url_re = re.compile(r'http://.*\.huffingtonpost\.com/20[01][0-9]/[0-9]{2}/[0-9]{2}.*')
     name = 'HuffPost'
-
-    def is_article(self, url):
-        return bool(self.url_re.match(url))
+    canonical = Canonicalizer(URL, strip=['ir', 'ref', 'ncid', 'cps'])
+    rules = UrlRules(allow=['huffington'],
+                     deny=['voces'],
+                     article=url_re)
 
     def cleanup_title(self, title):
         return title
 
-    def may_crawl(self, url):
-        return 'huffington' in url and 'voces' not in url
-
 
 class DailyMailCrawler(NewsCrawler):
     URL = "http://www.dailymail.co.uk/"
     url_re = re.compile(r'http://www\.dailymail\.co\.uk/.*article-[0-9]{7}/.*\.html')
     name = 'DailyMail'
-
-    def is_article(self, url):
-        x = bool(self.url_re.match(url))
-        return x and not url.endswith("emailArticle.html")
+    canonical = Canonicalizer(URL, strip=['ito', 'ico'])
+    rules = UrlRules(allow=['dailymail'],
+                     article=url_re,
+                     article_deny_suffix=['emailArticle.html'])
+    TITLE_DECORATION = re.compile(r'\| Mail Online$')
 
     def cleanup_title(self, title):
         return (title + '|').split('|')[0].strip()
 
-    def may_crawl(self, url):
-        return 'dailymail' in url
-
 
 class FoxNewsCrawler(NewsCrawler):
     URL = "http://www.foxnews.com/"
     url_re = re.compile(r'http://.*foxnews\.com/.*/20[01][0-9]/'
                         r'[0-9]{2}/[0-9]{2}/.*')
     name = 'FoxNews'
-
-    def is_article(self, url):
-        return bool(self.url_re.match(url)) and '/blog/' not in url
+    canonical = Canonicalizer(URL, strip=['intcmp', 'cmpid'])
+    rules = UrlRules(allow=['foxnews'],
+                     deny=['video.foxnews'],
+                     article=url_re,
+                     article_deny=['/blog/'])
+    TITLE_DECORATION = re.compile(r'\| Fox News$')
 
     def cleanup_title(self, title):
         return (title + '|').split('|')[0].strip()
 
-    def may_crawl(self, url):
-        return 'foxnews' in url and 'video.foxnews' not in url
-
 
 # This one is a bit iffy still
 class CNNCrawler(NewsCrawler):
@@ -278,11 +1065,12 @@ class CNNCrawler(NewsCrawler):
     url_re = re.compile(r'http://.*\.cnn\.com/[a-zA-Z]*/?'
                         r'20[01][0-9]/[0-9]{2}/[0-9]{2}/.+')
     name = 'CNN'
-
-    def is_article(self, url):
-        return (bool(self.url_re.match(url)) and
-                'comment' not in url and
-                '.blogs.' not in url)
+    canonical = Canonicalizer(URL, strip=['hpt', 'iref', 'sr', 'iid', 'eref'])
+    rules = UrlRules(allow=['cnn'],
+                     deny=['TRANSCRIPTS', 'ac360', 'cnnmexico'],
+                     article=url_re,
+                     article_deny=['comment', '.blogs.'])
+    TITLE_DECORATION = re.compile(r'( - |&#8211;?\s*)CNN(\.com)?$')
 
     def cleanup_title(self, title):
         sep = title.find('&#8211')
@@ -290,158 +1078,264 @@ class CNNCrawler(NewsCrawler):
             title = title[:sep]
         return (title + ' - ').split(' - ')[0].strip()
 
-    def may_crawl(self, url):
-        return ('cnn' in url and 'TRANSCRIPTS' not in url
-                and 'ac360' not in url and 'cnnmexico' not in url)
-
 
 class WashingtonPostCrawler(NewsCrawler):
     URL = "http://www.washingtonpost.com/"
     url_re = re.compile(r'http://.*\.washingtonpost\.com/.*/?'
                         r'20[01][00-9]/[0-9]{2}/[0-9]{2}/.*')
     name = 'WashingtonPost'
-
-    def is_article(self, url):
-        return bool(self.url_re.match(url)) and '/blogs/' not in url
+    canonical = Canonicalizer(URL, strip=['hpid', 'tid', 'wpisrc', 'wpmm',
+                                          'wprss'])
+    rules = UrlRules(allow=['washingtonpost'],
+                     article=url_re,
+                     article_deny=['/blogs/'])
+    TITLE_DECORATION = re.compile(r'- The Washington Post$')
 
     def cleanup_title(self, title):
         return (title.strip().replace('\n', ' ') + '-').split('-')[0].strip()
 
-    def may_crawl(self, url):
-        return 'washingtonpost' in url
-
 
 class LATimesCrawler(NewsCrawler):
     URL = "http://www.latimes.com/"
     url_re = re.compile(r'http://www\.latimes\.com/.*20[01][0-9]{5}.*story.*')
     name = 'LATimes'
-
-    def is_article(self, url):
-        return bool(self.url_re.match(url))
+    canonical = Canonicalizer(URL, strip=['track', 'int'])
+    rules = UrlRules(allow=['latimes'],
+                     article=url_re)
+    TITLE_DECORATION = re.compile(r' - (LA Times|Los Angeles Times)$')
 
     def cleanup_title(self, title):
         return (title + ' - ').split(' - ')[0].strip()
 
-    def may_crawl(self, url):
-        return 'latimes' in url
-
 
 class ReutersCrawler(NewsCrawler):
     URL = "http://www.reuters.com/"
     url_re = re.compile(r'http://www.reuters.com/article/'
                         r'20[01][0-9]/[0-9]{2}/[0-9]{2}/.*')
     name = 'Reuters'
-
-    def is_article(self, url):
-        return bool(self.url_re.match(url))
+    canonical = Canonicalizer(URL, strip=['feedType', 'feedName', 'rpc', 'sp'])
+    rules = UrlRules(allow=['reuters'],
+                     deny=['/video/'],
+                     article=url_re)
+    TITLE_DECORATION = re.compile(r'\n')
 
     def cleanup_title(self, title):
         return (title.strip() + '\n').split('\n')[0].strip()
 
-    def may_crawl(self, url):
-        return 'reuters' in url and '/video/' not in url
-
 
 class WallStreetJournalCrawler(NewsCrawler):
     URL = "http://online.wsj.com/"
     url_re = re.compile(r'http://(www|online).wsj.com/(news/)?articles?/.*')
     name = 'WallStreetJournal'
-
-    def is_article(self, url):
-        return bool(self.url_re.match(url))
+    canonical = Canonicalizer(URL, strip=['mod', 'mg', 'tesla', 'reflink'])
+    rules = UrlRules(allow=['wsj.com'],
+                     article=url_re)
+    TITLE_DECORATION = re.compile(r' - WSJ(\.com)?$')
 
     def cleanup_title(self, title):
         return (title.strip() + ' - ').split(' - ')[0].strip()
 
-    def may_crawl(self, url):
-        return 'wsj.com' in url
-
 
 class USATodayCrawler(NewsCrawler):
     URL = "http://www.usatoday.com/"
     url_re = re.compile(r'http://www.usatoday.com/(.*/)?story/.*')
     name = 'USAToday'
-
-    def is_article(self, url):
-        return bool(self.url_re.match(url))
+    canonical = Canonicalizer(URL, strip=['csp', 'hootPostID'])
+    rules = UrlRules(allow=['usatoday.com'],
+                     deny=['mediagallery',
+                           'sportsdata',
+                           'sportspolls',
+                           '/tag/',
+                           '/salaries/',
+                           '/statistics/',
+                           '/event/'],
+                     article=url_re)
 
     def cleanup_title(self, title):
         return title
 
-    def may_crawl(self, url):
-        return ('usatoday.com' in url and
-                'mediagallery' not in url and
-                'sportsdata' not in url and
-                'sportspolls' not in url and
-                '/tag/' not in url and
-                '/salaries/' not in url and
-                '/statistics/' not in url and
-                '/event/' not in url)
-
 
 class DailyNewsCrawler(NewsCrawler):
     URL = "http://www.nydailynews.com/"
     url_re = re.compile(r'http://www.nydailynews.com/.*-article-.*')
     name = 'NYDailyNews'
-
-    def is_article(self, url):
-        return bool(self.url_re.match(url))
+    canonical = Canonicalizer(URL, strip=['cid'])
+    rules = UrlRules(allow=['nydailynews'],
+                     article=url_re)
+    TITLE_DECORATION = re.compile(r' - NY Daily News$')
 
     def cleanup_title(self, title):
         return (title.strip() + ' - ').split(' - ')[0].strip()
 
-    def may_crawl(self, url):
-        return 'nydailynews' in url
-
 
 class NewYorkPostCrawler(NewsCrawler):
     URL = "http://nypost.com/"
     url_re = re.compile(r'http://nypost.com/20[01][0-9]/[0-9]{2}/[0-9]{2}/.*/$')
     name = 'NewYorkPost'
-
-    def is_article(self, url):
-        return bool(self.url_re.match(url))
+    canonical = Canonicalizer(URL, strip=['_ga', 'share'])
+    rules = UrlRules(allow=['nypost.com'],
+                     article=url_re)
+    TITLE_DECORATION = re.compile(r'\| New York Post$')
 
     def cleanup_title(self, title):
         return (title.strip() + '|').split('|')[0].strip()
 
-    def may_crawl(self, url):
-        return 'nypost.com' in url
 
+# all crawlers, by class; instances and their state are made on demand
+CRAWLERS = [NYTimesCrawler,
+            BBCCrawler,
+            HuffPostCrawler,
+            DailyMailCrawler,
+            FoxNewsCrawler,
+            CNNCrawler,
+            WashingtonPostCrawler,
+            LATimesCrawler,
+            ReutersCrawler,
+            WallStreetJournalCrawler,
+            USATodayCrawler,
+            DailyNewsCrawler,
+            NewYorkPostCrawler]
 
-crawlers = [NYTimesCrawler(),
-            BBCCrawler(),
-            HuffPostCrawler(),
-            DailyMailCrawler(),
-            FoxNewsCrawler(),
-            CNNCrawler(),
-            WashingtonPostCrawler(),
-            LATimesCrawler(),
-            ReutersCrawler(),
-            WallStreetJournalCrawler(),
-            USATodayCrawler(),
-            DailyNewsCrawler(),
-            NewYorkPostCrawler()]
+_instances = {}
 
 
-def main():
-    active = []
-    for c in crawlers:
-        # c.crawl(ARTICLE_COUNT)
-        # continue
-        while len(active) >= THREADS:
-            for i in range(len(active)):
-                active[i].join(1.0)
-                if not active[i].isAlive():
-                    active.pop(i)
-                    break
+def crawler_class(name):
+    """Returns the crawler class called name.
+
+    name is a class name like 'BBCCrawler' or a source name like
+    'BBC', in any case. Raises KeyError for unknown names.
+    """
+
+    key = name.lower()
+    for cls in CRAWLERS:
+        if key in (cls.__name__.lower(), cls.name.lower()):
+            return cls
+    raise KeyError(name)
+
+
+def crawler(name):
+    """Returns the crawler called name, loading its state on first use."""
 
-        t = threading.Thread(target=c.crawl, args=(ARTICLE_COUNT,),
-                             name=c.__class__.__name__)
-        t.start()
-        active.append(t)
+    cls = crawler_class(name)
+    if cls not in _instances:
+        _instances[cls] = cls()
+    return _instances[cls]
 
-    return 0
+
+def _init_worker():
+    # interrupts are handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_crawler(name):
+    """Runs a crawler in a pool process until done or terminated.
+
+    Returns (crawler class name, whether it failed). A failing crawler
+    prints its traceback, as the others go on.
+    """
+
+    c = crawler(name)
+    signal.signal(signal.SIGTERM, lambda signum, frame: c.stop())
+    failed = False
+    try:
+        c.crawl(ARTICLE_COUNT)
+        if DAEMON and not c._stopping:
+            c.daemon()
+    except Exception:
+        traceback.print_exc()
+        failed = True
+    finally:
+        # an idle worker is killed by the terminating pool as usual
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if c._stopping:
+        # the terminating pool holds the task queue lock, so exit
+        # rather than go back for another task
+        sys.exit(0)
+    return c.__class__.__name__, failed
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def main():
+    global ARTICLE_COUNT, PROCESSES, CONCURRENCY, PER_HOST, HOST_RATE
+    global DAEMON, DISCOVERY, METRICS_PORT, VERBOSE
+
+    parser = argparse.ArgumentParser(
+        description='Crawls news sites for headlines phrased as questions.')
+    parser.add_argument('sites', nargs='*', metavar='SITE',
+                        help='crawlers to run, by name (default: all)')
+    parser.add_argument('-l', '--list', action='store_true',
+                        help='list the crawlers and exit')
+    parser.add_argument('-n', '--articles', type=int, default=ARTICLE_COUNT,
+                        help='articles to find per site')
+    parser.add_argument('-j', '--processes', type=int, default=PROCESSES,
+                        help='sites crawled at the same time')
+    parser.add_argument('-t', '--threads', type=int, default=CONCURRENCY,
+                        help='fetches in flight per site')
+    parser.add_argument('--per-host', type=int, default=PER_HOST,
+                        help='fetches in flight per host')
+    parser.add_argument('--rate', type=float, default=HOST_RATE,
+                        help='fetches per second per host')
+    parser.add_argument('--daemon', action='store_true', default=DAEMON,
+                        help='keep recrawling hubs for new articles')
+    parser.add_argument('--discovery', action='store_true',
+                        default=DISCOVERY,
+                        help='seed the crawl from sitemaps and feeds')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        default=VERBOSE)
+    args = parser.parse_args()
+
+    if args.list:
+        for cls in CRAWLERS:
+            print "%-18s %s" % (cls.name, cls.URL)
+        return 0
+    try:
+        names = [crawler_class(name).__name__
+                 for name in args.sites or [c.__name__ for c in CRAWLERS]]
+    except KeyError, e:
+        parser.error('unknown site %s' % e)
+
+    # pool processes inherit these
+    ARTICLE_COUNT = args.articles
+    PROCESSES = args.processes
+    CONCURRENCY = args.threads
+    PER_HOST = args.per_host
+    HOST_RATE = args.rate
+    DAEMON = args.daemon
+    DISCOVERY = args.discovery
+    METRICS_PORT = args.metrics_port
+    VERBOSE = args.verbose
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT, 'metrics_*.prom')
+    # daemons never finish, so each needs a process of its own
+    processes = len(names) if DAEMON else min(PROCESSES, len(names))
+    pool = multiprocessing.Pool(processes, _init_worker)
+    failures = 0
+    try:
+        done = pool.imap_unordered(_run_crawler, names)
+        while True:
+            # a timeout keeps the wait interruptible
+            try:
+                name, failed = done.next(1.0)
+            except multiprocessing.TimeoutError:
+                continue
+            except StopIteration:
+                break
+            print "%s %s" % ('Failed' if failed else 'Finished', name)
+            failures += failed
+        pool.close()
+    except KeyboardInterrupt:
+        print "Stopping crawlers"
+        # sends SIGTERM, making each crawler sync its state and exit
+        pool.terminate()
+    pool.join()
+
+    return 1 if failures else 0
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,108 @@
+"""Groups near-identical headlines with MinHash.
+
+Candidate pairs are found by locality-sensitive hashing of the MinHash
+signatures, so not every pair of headlines is compared.
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+SHINGLE = 5  # characters per shingle
+BANDS = 16
+ROWS = 4  # signature values per band
+THRESHOLD = 0.6  # estimated Jaccard similarity of near-duplicates
+
+_PRIME = (1 << 31) - 1
+_space_re = re.compile(r'[\W_]+', re.U)
+
+
+def shingles(title):
+    """Returns the set of hashed character shingles of a title."""
+
+    text = _space_re.sub(' ', title.lower()).strip()
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    if len(text) <= SHINGLE:
+        return set([zlib.crc32(text) & 0xffffffff])
+    return set(zlib.crc32(text[i:i + SHINGLE]) & 0xffffffff
+               for i in range(len(text) - SHINGLE + 1))
+
+
+class MinHasher(object):
+    """Computes MinHash signatures of BANDS * ROWS values."""
+
+    def __init__(self, seed=1):
+        rng = np.random.RandomState(seed)
+        n = BANDS * ROWS
+        self.a = rng.randint(1, _PRIME, n).astype(np.int64)[:, None]
+        self.b = rng.randint(0, _PRIME, n).astype(np.int64)[:, None]
+
+    def signature(self, title):
+        x = np.fromiter(shingles(title), np.int64) % _PRIME
+        return ((self.a * x + self.b) % _PRIME).min(axis=1)
+
+
+def similarity(a, b):
+    """Returns the Jaccard similarity of titles estimated from signatures."""
+
+    return (a == b).mean()
+
+
+def clusters(hlines, threshold=THRESHOLD):
+    """Groups hlines whose titles are near-duplicates.
+
+    Headlines sharing a signature band are compared by their
+    estimated similarity, so the work grows with the number of
+    headlines and not with its square. A headline only joins a
+    cluster if it's a near-duplicate of the headline the cluster
+    started with, so clusters don't chain into one another. Returns a
+    list of lists of headlines, largest first, each headline in
+    exactly one list.
+    """
+
+    hasher = MinHasher()
+    sigs = np.array([hasher.signature(h['title']) for h in hlines])
+    first = range(len(hlines))  # headline each one's cluster started with
+    size = [1] * len(hlines)
+    for band in range(BANDS):
+        buckets = {}
+        cols = sigs[:, band * ROWS:(band + 1) * ROWS] if len(hlines) else []
+        for i, key in enumerate(cols):
+            buckets.setdefault(key.tostring(), []).append(i)
+        for members in buckets.itervalues():
+            if len(members) < 2:
+                continue
+            starts = sorted(set(first[i] for i in members
+                                if size[first[i]] > 1))
+            for i in members:
+                if size[first[i]] > 1:
+                    continue
+                for j in starts:
+                    if similarity(sigs[j], sigs[i]) >= threshold:
+                        first[i] = j
+                        size[j] += 1
+                        break
+                else:
+                    starts.append(i)
+
+    groups = {}
+    for i in range(len(hlines)):
+        groups.setdefault(first[i], []).append(hlines[i])
+    return sorted(groups.values(), key=len, reverse=True)
+
+
+def stats(groups):
+    """Returns a dict of statistics of clusters made by clusters()."""
+
+    sizes = [len(g) for g in groups]
+    dupes = [n for n in sizes if n > 1]
+    return {'headlines': sum(sizes),
+            'clusters': len(sizes),
+            'with_duplicates': len(dupes),
+            'duplicates': sum(dupes) - len(dupes),
+            'largest': max(sizes) if sizes else 0,
+            'mean_size': float(sum(sizes)) / len(sizes) if sizes else 0.0,
+            'cross_source': sum(1 for g in groups
+                                if len(set(h['source'] for h in g)) > 1)}
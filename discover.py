@@ -0,0 +1,80 @@
+"""Finds article URLs and titles in sitemaps and RSS or Atom feeds."""
+
+import StringIO
+import collections
+import xml.etree.cElementTree as ElementTree
+import zlib
+
+# url and title of a page or of another feed, title and lastmod None
+# if the document didn't tell
+Entry = collections.namedtuple('Entry', 'url title lastmod is_feed')
+
+# elements holding one entry each, and whether it points to a feed
+_ENTRIES = {'url': False, 'sitemap': True, 'item': False, 'entry': False}
+
+ParseError = SyntaxError
+
+
+def robots_sitemaps(text):
+    """Returns the sitemap URLs listed in a robots.txt."""
+
+    urls = []
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        if key.strip().lower() == 'sitemap' and value.strip():
+            urls.append(value.strip())
+    return urls
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse(data):
+    """Yields an Entry for each page or feed listed in a feed document.
+
+    data is a sitemap, sitemap index, RSS or Atom document, possibly
+    gzipped. The document is parsed incrementally and each entry is
+    discarded once yielded. Raises ParseError on malformed XML or
+    gzip data, after yielding the entries before the error.
+    """
+
+    if data[:2] == '\x1f\x8b':
+        try:
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        except zlib.error, e:
+            raise ParseError('bad gzip data: %s' % e)
+
+    parents = []
+    url = title = lastmod = None
+    for event, elem in ElementTree.iterparse(StringIO.StringIO(data),
+                                             ('start', 'end')):
+        tag = _local(elem.tag)
+        if event == 'start':
+            parents.append(elem)
+            if tag in _ENTRIES:
+                url = title = lastmod = None
+            continue
+
+        parents.pop()
+        text = (elem.text or '').strip()
+        # the first of each wins, as image sitemaps nest <image:loc>
+        # and <image:title> in <url>
+        if tag == 'loc':
+            url = url or text
+        elif tag == 'link' and not url:
+            # RSS has the URL as text, Atom in href
+            if text:
+                url = text
+            elif elem.get('rel', 'alternate') == 'alternate':
+                url = (elem.get('href') or '').strip()
+        elif tag == 'title':
+            title = title or text or None
+        elif tag in ('lastmod', 'updated'):
+            lastmod = lastmod or text or None
+        elif tag in _ENTRIES:
+            if url:
+                yield Entry(url, title, lastmod, _ENTRIES[tag])
+            url = title = lastmod = None
+            if parents:
+                parents[-1].remove(elem)
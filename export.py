@@ -0,0 +1,235 @@
+"""Exports the stored articles and answers to Parquet or Arrow IPC files.
+
+Each table goes to a directory per source, and each export adds a part
+file per source with the rows stored since the last export:
+
+    export/articles/BBC/part-000000000001-000000052113.parquet
+    export/answers/BBC/part-000000000001-000000000740.parquet
+
+so a source, or a few columns, can be read without reading the rest.
+Rows replaced in the store, like changed answers, are exported again
+with a higher seq; keep the row with the highest seq of each article
+(source, url) or answer (source, title) for the current ones. Rows
+deleted from the store stay in the export until it's redone with
+--full.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import store
+
+DIRNAME = 'export'
+FORMAT = 'parquet'  # compressed; or 'arrow' for memory-mapped reading
+COMPRESSION = 'snappy'  # of parquet files
+BATCH = 50000  # rows read from the store and written at a time
+WATERMARK = 'watermark.json'  # seq of the last row exported, per table
+
+SCHEMAS = {
+    'articles': pa.schema([('seq', pa.int64()),
+                           ('source', pa.string()),
+                           ('title', pa.string()),
+                           ('raw_title', pa.string()),
+                           ('url', pa.string())]),
+    'answers': pa.schema([('seq', pa.int64()),
+                          ('source', pa.string()),
+                          ('title', pa.string()),
+                          ('answer', pa.string()),
+                          ('auto', pa.bool_())]),
+}
+
+_part_re = re.compile(r'part-(\d+)-(\d+)\.(parquet|arrow)$')
+
+
+class _PartWriter(object):
+    """Writes record batches to a part file, put in place by close()."""
+
+    def __init__(self, fname, schema, fmt):
+        self.fname = fname
+        self.tmp = fname + '.tmp'
+        self._sink = None
+        if fmt == 'parquet':
+            self._writer = pq.ParquetWriter(self.tmp, schema,
+                                            compression=COMPRESSION)
+        else:
+            self._sink = pa.OSFile(self.tmp, 'wb')
+            self._writer = pa.RecordBatchFileWriter(self._sink, schema)
+
+    def write(self, batch):
+        if self._sink is None:
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+        if self._sink is not None:
+            self._sink.close()
+        os.rename(self.tmp, self.fname)
+
+
+def _batch(schema, rows):
+    """Returns a RecordBatch of rows, tuples of the fields of schema."""
+
+    arrays = []
+    for values, field in zip(zip(*rows), schema):
+        # SQLite has no booleans
+        if field.type == pa.bool_():
+            values = [bool(v) for v in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _parts(dirname, table, sources=None):
+    """Yields (source, first seq, last seq, path) of the parts of table."""
+
+    top = os.path.join(dirname, table)
+    if not os.path.isdir(top):
+        return
+    for source in sorted(os.listdir(top)):
+        if sources is not None and source not in sources:
+            continue
+        for f in sorted(os.listdir(os.path.join(top, source))):
+            m = _part_re.match(f)
+            if m:
+                yield (source, int(m.group(1)), int(m.group(2)),
+                       os.path.join(top, source, f))
+
+
+def _watermarks(dirname):
+    fname = os.path.join(dirname, WATERMARK)
+    if not os.path.exists(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+
+def _set_watermarks(dirname, marks):
+    fname = os.path.join(dirname, WATERMARK)
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(marks, f, indent=2, sort_keys=True)
+    os.rename(fname + '.tmp', fname)
+
+
+def export_table(db, table, dirname=DIRNAME, fmt=FORMAT):
+    """Appends the rows of table stored since the last export.
+
+    Rows are streamed from the store BATCH at a time, into a new part
+    file per source. Returns the number of rows exported.
+    """
+
+    marks = _watermarks(dirname)
+    since = marks.get(table, 0)
+    until = db.last_seq(table)
+
+    # parts of an export that died before its watermark was written
+    for _, first, _, path in list(_parts(dirname, table)):
+        if first > since:
+            os.remove(path)
+    for d, _, files in os.walk(os.path.join(dirname, table)):
+        for f in files:
+            if f.endswith('.tmp'):
+                os.remove(os.path.join(d, f))
+    if until <= since:
+        return 0
+
+    schema = SCHEMAS[table]
+    name = 'part-%012d-%012d.%s' % (since + 1, until, fmt)
+    rows = db.rows(table, since, until)
+    writer = source = None
+    count = 0
+    while True:
+        chunk = rows.fetchmany(BATCH)
+        if not chunk:
+            break
+        count += len(chunk)
+        for src, group in itertools.groupby(chunk, lambda row: row[1]):
+            if src != source:
+                if writer is not None:
+                    writer.close()
+                source = src
+                d = os.path.join(dirname, table, source)
+                if not os.path.isdir(d):
+                    os.makedirs(d)
+                writer = _PartWriter(os.path.join(d, name), schema, fmt)
+            writer.write(_batch(schema, list(group)))
+    if writer is not None:
+        writer.close()
+
+    marks[table] = until
+    _set_watermarks(dirname, marks)
+    return count
+
+
+def export(db, dirname=DIRNAME, fmt=FORMAT, full=False):
+    """Exports articles and answers. Returns a dict of rows per table.
+
+    If full is set, earlier exports are removed and everything is
+    exported again.
+    """
+
+    if full and os.path.exists(dirname):
+        shutil.rmtree(dirname)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    return dict((table, export_table(db, table, dirname, fmt))
+                for table in sorted(SCHEMAS))
+
+
+def read(table, columns=None, sources=None, dirname=DIRNAME):
+    """Returns a pyarrow Table of the exported rows of table.
+
+    Only the given columns of the given sources are read, and Arrow
+    IPC parts are memory-mapped rather than read.
+    """
+
+    columns = list(columns or SCHEMAS[table].names)
+    tables = []
+    for _, _, _, path in _parts(dirname, table, sources):
+        if path.endswith('.parquet'):
+            tables.append(pq.read_table(path, columns=columns,
+                                        memory_map=True))
+        else:
+            t = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            tables.append(pa.Table.from_arrays(
+                [t.column(c) for c in columns], names=columns))
+    if not tables:
+        return pa.Table.from_batches([], pa.schema(
+            [SCHEMAS[table].field(c) for c in columns]))
+    return pa.concat_tables(tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Exports the stored articles and answers.')
+    parser.add_argument('-o', '--output', default=DIRNAME,
+                        help='directory to export to')
+    parser.add_argument('-f', '--format', choices=('parquet', 'arrow'),
+                        default=FORMAT)
+    parser.add_argument('--full', action='store_true',
+                        help='export everything again')
+    args = parser.parse_args()
+
+    if not os.path.exists(store.FILENAME):
+        parser.error('no %s to export' % store.FILENAME)
+    db = store.HeadlineStore(store.FILENAME)
+    try:
+        counts = export(db, args.output, args.format, args.full)
+    finally:
+        db.close()
+    for table, count in sorted(counts.items()):
+        print "Exported %d %s to %s" % (count, table,
+                                        os.path.join(args.output, table))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Pulls the title and links out of HTML pages without building a tree."""
+
+import HTMLParser
+import re
+import urlparse
+
+
+_charset_re = re.compile(r'''charset=["']?([-\w.:]+)''', re.I)
+
+# One pass over the page visits each comment, script, style, title and
+# a/base/link tag in document order. Everything else is skipped by the
+# regex engine without ever reaching Python code.
+_token_re = re.compile(r'''
+    <!--.*?-->
+  | <(?P<raw>script|style)\b.*?</(?P=raw)\s*>
+  | <title\b[^>]*>(?P<title>.*?)</title\s*>
+  | <(?P<tag>a|base|link)\s(?P<attrs>[^>]*)>
+''', re.I | re.S | re.X)
+
+_href_re = re.compile(r'''\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''',
+                      re.I)
+
+_canonical_re = re.compile(r'''(?:^|\s)rel\s*=\s*["']?canonical\b''', re.I)
+
+_unescape = HTMLParser.HTMLParser().unescape
+
+
+def decode_page(page, content_type=None):
+    """Decodes page to unicode.
+
+    The charset is taken from the Content-Type header, a <meta> tag
+    or defaults to UTF-8. Undecodable bytes are replaced.
+    """
+
+    for s in (content_type or '', page[:4096]):
+        m = _charset_re.search(s)
+        if m:
+            try:
+                return page.decode(m.group(1), 'replace')
+            except LookupError:
+                pass
+    return page.decode('utf-8', 'replace')
+
+
+class _Resolver(object):
+    """Makes hrefs absolute, avoiding urljoin() for the common cases."""
+
+    def __init__(self, base):
+        self.set_base(base)
+
+    def set_base(self, base):
+        self.base = base
+        parts = urlparse.urlsplit(base)
+        self.scheme = parts.scheme
+        self.origin = '%s://%s' % (parts.scheme, parts.netloc)
+
+    def __call__(self, href):
+        if '&' in href:
+            href = _unescape(href)
+        href = href.strip()
+        if href.startswith(('http://', 'https://')):
+            url = href
+        elif href.startswith('//'):
+            url = self.scheme + ':' + href
+        elif href.startswith('/'):
+            url = self.origin + href
+        else:
+            url = urlparse.urljoin(self.base, href)
+        i = url.find('#')
+        if i >= 0:
+            url = url[:i]
+        if url.startswith(('http://', 'https://')):
+            return url
+        return None
+
+
+def extract(page, url):
+    """Returns (title, links, canonical) of an HTML page fetched from url.
+
+    title is the raw text of the first <title>, or None if the page
+    has none. Links are resolved against url, or the page's <base> if
+    it has one, and stripped of fragments. Non-HTTP links are left
+    out. canonical is the URL of the first <link rel="canonical">, or
+    None if there is none.
+    """
+
+    resolve = _Resolver(url)
+    title = canonical = None
+    links = []
+    for m in _token_re.finditer(page):
+        tag = m.group('tag')
+        if tag is not None:
+            h = _href_re.search(m.group('attrs'))
+            if not h:
+                continue
+            href = h.group(1) or h.group(2) or h.group(3) or ''
+            tag = tag.lower()
+            if tag == 'base':
+                resolve.set_base(urlparse.urljoin(url, href.strip()))
+                continue
+            if tag == 'link':
+                if (canonical is None and
+                    _canonical_re.search(m.group('attrs'))):
+                    canonical = resolve(href)
+                continue
+            link = resolve(href)
+            if link:
+                links.append(link)
+        elif m.group('title') is not None and title is None:
+            title = m.group('title')
+    return title, links, canonical
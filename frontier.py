@@ -0,0 +1,83 @@
+"""The set of URLs a crawler has yet to fetch."""
+
+import random
+import sys
+
+
+class Frontier(object):
+    """Set of URLs with O(1) add, membership test and random pop.
+
+    URLs are kept in two tiers. pop() returns a random URL from the
+    priority tier if it is non-empty and from the normal tier
+    otherwise.
+    """
+
+    def __init__(self, urls=()):
+        self._tiers = ([], [])
+        self._index = {}
+        for url in urls:
+            self.add(url)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, url):
+        return url in self._index
+
+    def __iter__(self):
+        return iter(self._tiers[1] + self._tiers[0])
+
+    def __getstate__(self):
+        return {'tiers': self._tiers}
+
+    def __setstate__(self, state):
+        self._tiers = state['tiers']
+        self._index = {}
+        for tier, urls in enumerate(self._tiers):
+            for i, url in enumerate(urls):
+                self._index[url] = (tier, i)
+
+    def memory_usage(self):
+        """Returns an estimate of the number of bytes used."""
+
+        size = sys.getsizeof(self) + sys.getsizeof(self._index)
+        for urls in self._tiers:
+            size += sys.getsizeof(urls) + sum(sys.getsizeof(u) for u in urls)
+        return size
+
+    def add(self, url, priority=False):
+        """Adds url unless already present."""
+
+        if url in self._index:
+            return
+        urls = self._tiers[1 if priority else 0]
+        self._index[url] = (1 if priority else 0, len(urls))
+        urls.append(url)
+
+    def discard(self, url):
+        """Removes url if present."""
+
+        if url not in self._index:
+            return
+        tier, i = self._index.pop(url)
+        self._take(self._tiers[tier], tier, i)
+
+    def pop(self):
+        """Removes and returns a random URL, preferring priority URLs."""
+
+        tier = 1 if self._tiers[1] else 0
+        urls = self._tiers[tier]
+        if not urls:
+            raise KeyError('pop from an empty frontier')
+        url = self._take(urls, tier, random.randrange(len(urls)))
+        del self._index[url]
+        return url
+
+    def _take(self, urls, tier, i):
+        """Removes urls[i] by moving the last URL into its slot."""
+
+        url, last = urls[i], urls.pop()
+        if i < len(urls):
+            urls[i] = last
+            self._index[last] = (tier, i)
+        return url
@@ -0,0 +1,182 @@
+"""Keep-alive HTTP connections shared by the fetchers of a crawler."""
+
+import collections
+import httplib
+import socket
+import threading
+import urlparse
+import zlib
+
+
+# size is the number of bytes received for body, before decoding
+Response = collections.namedtuple('Response', 'url status headers body size')
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class FetchError(Exception):
+    """Raised when a URL can't be fetched for reasons other than I/O."""
+
+
+class HTTPError(FetchError):
+    """Raised on HTTP error statuses."""
+
+    def __init__(self, url, status):
+        FetchError.__init__(self, '%s returned %d' % (url, status))
+        self.url = url
+        self.status = status
+
+
+def decode_body(body, encoding):
+    """Undoes gzip or deflate content encoding."""
+
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        # servers disagree on whether deflate means zlib or raw deflate
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+class HTTPPool(object):
+    """Pool of persistent HTTP connections.
+
+    At most size idle connections are kept open per host. Requests
+    check out an idle connection if there is one and open a new one
+    otherwise, so concurrency is bounded by the caller, not the pool.
+
+    Connecting times out after connect_timeout seconds and every
+    subsequent socket read after read_timeout seconds, so a stalled
+    server can't hang a fetcher forever.
+
+    If proxy is a (host, port) tuple, plain HTTP requests are sent
+    through that proxy.
+    """
+
+    def __init__(self, size=4, connect_timeout=10, read_timeout=30,
+                 headers=(), max_redirects=5, proxy=None):
+        self.size = size
+        self.proxy = proxy
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.headers = dict(headers)
+        self.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.max_redirects = max_redirects
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'connections': 0, 'reused': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        """Returns a dict of request and connection counters."""
+
+        with self._lock:
+            return dict(self._stats)
+
+    def _checkout(self, origin):
+        """Returns (connection, reused) for origin."""
+
+        with self._lock:
+            idle = self._idle.get(origin)
+            if idle:
+                self._stats['reused'] += 1
+                return idle.pop(), True
+            self._stats['connections'] += 1
+
+        scheme, host, port = origin
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port,
+                                           timeout=self.connect_timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port,
+                                          timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn, False
+
+    def _checkin(self, origin, conn):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Closes all idle connections."""
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _request(self, url, headers):
+        """Performs a single GET without following redirects."""
+
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise FetchError('unsupported URL %r' % url)
+        if self.proxy and parts.scheme == 'http':
+            origin = ('http',) + tuple(self.proxy)
+            path = urlparse.urlunsplit(parts[:2] + (parts.path or '/',
+                                                    parts.query, ''))
+        else:
+            origin = (parts.scheme, parts.hostname,
+                      parts.port or (443 if parts.scheme == 'https' else 80))
+            path = urlparse.urlunsplit(('', '', parts.path or '/',
+                                        parts.query, ''))
+        hdrs = dict(self.headers)
+        hdrs.update(headers or {})
+
+        self._count('requests')
+        while True:
+            conn, reused = self._checkout(origin)
+            try:
+                conn.request('GET', path, headers=hdrs)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                # the server may have dropped an idle keep-alive
+                # connection, so give reused ones a second chance
+                if reused:
+                    continue
+                raise
+            break
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._checkin(origin, conn)
+
+        size = len(body)
+        body = decode_body(body, resp.getheader('content-encoding'))
+        return Response(url, resp.status, dict(resp.getheaders()), body, size)
+
+    def get(self, url, headers=None):
+        """Fetches url, following redirects.
+
+        Returns a Response for the final URL. Raises HTTPError on
+        error statuses, FetchError on unfetchable URLs and
+        httplib.HTTPException, socket.error or zlib.error on
+        connection and decoding failures.
+        """
+
+        for _ in range(self.max_redirects + 1):
+            resp = self._request(url, headers)
+            location = resp.headers.get('location')
+            if resp.status in REDIRECTS and location:
+                url = urlparse.urljoin(url, location)
+                continue
+            if resp.status >= 400:
+                raise HTTPError(url, resp.status)
+            return resp
+        raise FetchError('too many redirects at %s' % url)
@@ -0,0 +1,69 @@
+"""Append-only journal of pickled records."""
+
+import cPickle
+import os
+
+
+class Journal(object):
+    """Append-only file of pickled records.
+
+    Records are buffered by append() and made durable by sync(). A
+    record torn by a crash is dropped, along with anything after it,
+    the next time the journal is replayed.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.count = 0
+        self._f = None
+
+    def _file(self):
+        if self._f is None:
+            self._f = open(self.fname, 'ab')
+        return self._f
+
+    def replay(self):
+        """Yields all intact records in the journal, oldest first."""
+
+        if not os.path.exists(self.fname):
+            return
+        with open(self.fname, 'rb') as f:
+            good = 0
+            while True:
+                try:
+                    record = cPickle.load(f)
+                except EOFError:
+                    break
+                except (cPickle.UnpicklingError, ValueError,
+                        IndexError, AttributeError, ImportError):
+                    break
+                good = f.tell()
+                self.count += 1
+                yield record
+            torn = os.path.getsize(self.fname) != good
+
+        # cut off the torn tail so new records aren't appended after it
+        if torn:
+            with open(self.fname, 'r+b') as f:
+                f.truncate(good)
+
+    def append(self, record):
+        cPickle.dump(record, self._file(), cPickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+    def sync(self):
+        """Flushes appended records to disk."""
+
+        if self._f is not None:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def reset(self):
+        """Empties the journal."""
+
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        if os.path.exists(self.fname):
+            os.remove(self.fname)
+        self.count = 0
@@ -0,0 +1,192 @@
+"""Crawl instrumentation in the Prometheus text format."""
+
+import BaseHTTPServer
+import SocketServer
+import collections
+import contextlib
+import glob
+import os
+import threading
+import time
+
+# upper bounds in seconds of the histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(labels, extra=()):
+    items = sorted(labels.items()) + list(extra)
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', r'\"'))
+                             for k, v in items)
+
+
+def _num(x):
+    return repr(float(x)) if isinstance(x, float) else str(x)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """Thread-safe counters, gauges and histograms sharing a label set."""
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._counters = collections.OrderedDict()
+        self._gauges = collections.OrderedDict()
+        self._histograms = collections.OrderedDict()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram()
+            self._histograms[name].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Observes the seconds spent in the with block in histogram name."""
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+    def get(self, name):
+        """Returns the value of a counter or gauge, 0 if never set."""
+
+        with self._lock:
+            return self._counters.get(name, self._gauges.get(name, 0))
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format."""
+
+        lines = []
+        lbl = _labels(self.labels)
+        with self._lock:
+            for name, value in self._counters.items():
+                lines.append('# TYPE %s counter' % name)
+                lines.append('%s%s %s' % (name, lbl, _num(value)))
+            for name, value in self._gauges.items():
+                lines.append('# TYPE %s gauge' % name)
+                lines.append('%s%s %s' % (name, lbl, _num(value)))
+            for name, h in self._histograms.items():
+                lines.append('# TYPE %s histogram' % name)
+                total = 0
+                for b, c in zip(h.buckets + ('+Inf',), h.counts):
+                    total += c
+                    lines.append('%s_bucket%s %d' % (
+                        name, _labels(self.labels, [('le', b)]), total))
+                lines.append('%s_sum%s %s' % (name, lbl, _num(h.sum)))
+                lines.append('%s_count%s %d' % (name, lbl, h.count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, fname):
+        """Atomically writes the rendered metrics to fname."""
+
+        with open(fname + '.tmp', 'w') as f:
+            f.write(self.render())
+        os.rename(fname + '.tmp', fname)
+
+
+class MetricsWriter(threading.Thread):
+    """Writes metrics to a file every interval seconds until stopped."""
+
+    def __init__(self, metrics, fname, interval=10.0):
+        threading.Thread.__init__(self, name='metrics-writer')
+        self.daemon = True
+        self.metrics = metrics
+        self.fname = fname
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.metrics.write(self.fname)
+
+    def stop(self):
+        """Stops the thread after a final write."""
+
+        self._stop_event.set()
+        self.join()
+        self.metrics.write(self.fname)
+
+
+def merge(texts):
+    """Merges Prometheus texts, grouping samples by metric family."""
+
+    families = collections.OrderedDict()
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# TYPE '):
+                family = line.split()[2]
+                families.setdefault(family, [line])
+            elif line and not line.startswith('#') and family:
+                families[family].append(line)
+    return ''.join('\n'.join(lines) + '\n' for lines in families.values())
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        texts = []
+        for fname in sorted(glob.glob(self.server.pattern)):
+            with open(fname) as f:
+                texts.append(f.read())
+        body = merge(texts)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def serve(port, pattern, host='127.0.0.1'):
+    """Serves the metrics files matching pattern at /metrics.
+
+    Runs in a daemon thread; returns the server.
+    """
+
+    server = _Server((host, port), _Handler)
+    server.pattern = pattern
+    t = threading.Thread(target=server.serve_forever, name='metrics-server')
+    t.daemon = True
+    t.start()
+    return server
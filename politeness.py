@@ -0,0 +1,171 @@
+"""Per-host rate limiting, adaptive concurrency and circuit breaking."""
+
+import random
+import threading
+import time
+
+
+class TransientError(Exception):
+    """Raised by fetchers for failures that are worth retrying."""
+
+
+def backoff(attempt, base=2.0, cap=300.0):
+    """Returns a jittered delay in seconds before retry number attempt."""
+
+    return random.uniform(0.5, 1.5) * min(cap, base * 2 ** (attempt - 1))
+
+
+class TokenBucket(object):
+    """Allows rate events per second on average, in bursts of up to burst."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.stamp = time.time()
+
+    def wait_time(self, now):
+        """Returns seconds until a token is available, 0 if one is."""
+
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Host(object):
+    """Scheduling state of a single host."""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, rate, burst, limit):
+        self.bucket = TokenBucket(rate, burst)
+        self.limit = float(limit)
+        self.active = 0
+        self.latency = None
+        self.failures = 0
+        self.breaker = Host.CLOSED
+        self.trips = 0
+        self.open_until = 0
+
+
+class HostScheduler(object):
+    """Decides when a fetch from a host may start.
+
+    Each host gets a token bucket limiting the request rate and a
+    concurrency limit between 1 and max_concurrency. The limit grows
+    by about one per round of successful fetches and is halved when a
+    fetch fails or takes more than slow times the typical latency.
+
+    After failure_threshold consecutive failures the host's circuit
+    breaker opens, and no fetches start for cooldown seconds, doubling
+    with every trip up to max_cooldown. A single trial fetch is then
+    let through, which closes the breaker on success and reopens it on
+    failure.
+    """
+
+    def __init__(self, rate=4.0, burst=4, max_concurrency=4,
+                 failure_threshold=5, cooldown=30.0, max_cooldown=600.0,
+                 slow=3.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.slow = slow
+        self._hosts = {}
+        self._cond = threading.Condition()
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = Host(self.rate, self.burst,
+                                     self.max_concurrency)
+        return self._hosts[host]
+
+    def _wait_time(self, h, now):
+        """Returns seconds to wait before a fetch from h may start.
+
+        Returns None if the wait is for another fetch to finish.
+        """
+
+        if h.breaker == Host.OPEN:
+            if now < h.open_until:
+                return h.open_until - now
+            h.breaker = Host.HALF_OPEN
+        if h.breaker == Host.HALF_OPEN and h.active:
+            return None
+        if h.active >= int(h.limit):
+            return None
+        return h.bucket.wait_time(now)
+
+    def acquire(self, host, timeout=None):
+        """Blocks until a fetch from host may start.
+
+        Returns False if timeout seconds passed first, True otherwise.
+        Every successful acquire() must be followed by a release().
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            h = self._host(host)
+            while True:
+                now = time.time()
+                wait = self._wait_time(h, now)
+                if wait == 0:
+                    h.bucket.take()
+                    h.active += 1
+                    return True
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    wait = min(wait or deadline - now, deadline - now)
+                self._cond.wait(wait)
+
+    def release(self, host, latency, ok):
+        """Records the outcome of a fetch started by acquire()."""
+
+        with self._cond:
+            h = self._host(host)
+            h.active -= 1
+            if ok:
+                slow = (h.latency is not None and
+                        latency > self.slow * h.latency)
+                h.latency = (latency if h.latency is None else
+                             0.8 * h.latency + 0.2 * latency)
+                h.failures = 0
+                if h.breaker == Host.HALF_OPEN:
+                    h.breaker = Host.CLOSED
+                    h.trips = 0
+                if slow:
+                    h.limit = max(1.0, h.limit / 2)
+                else:
+                    h.limit = min(self.max_concurrency,
+                                  h.limit + 1 / h.limit)
+            else:
+                h.failures += 1
+                h.limit = max(1.0, h.limit / 2)
+                if (h.breaker == Host.HALF_OPEN or
+                    h.failures >= self.failure_threshold):
+                    h.breaker = Host.OPEN
+                    # a dead host trips forever, and 2.0 ** 1024 overflows
+                    h.open_until = time.time() + min(
+                        self.max_cooldown,
+                        self.cooldown * 2 ** min(h.trips, 20))
+                    h.trips += 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """Returns a dict of host to a dict of its scheduling state."""
+
+        with self._cond:
+            return dict((host, {'limit': h.limit,
+                                'active': h.active,
+                                'latency': h.latency,
+                                'breaker': h.breaker})
+                        for host, h in self._hosts.items())
@@ -0,0 +1,83 @@
+"""Draws charts in-process, several at once, and writes them atomically."""
+
+import multiprocessing
+import os
+
+import numpy as np
+
+
+def _save(fig, fname):
+    """Writes fig to fname as a PNG, never leaving a partial file."""
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    FigureCanvasAgg(fig)
+    tmp = '%s.%d.tmp' % (fname, os.getpid())
+    fig.savefig(tmp, format='png', bbox_inches='tight')
+    os.rename(tmp, fname)
+
+
+def piechart(fname, labels, values, colors, title=None):
+    """Draws a pie of values, one slice per label."""
+
+    # matplotlib is slow to import, and only needed when drawing
+    from matplotlib.figure import Figure
+    fig = Figure()
+    if title:
+        fig.suptitle(title)
+    ax = fig.add_subplot(111)
+    ax.pie(values, labels=labels, colors=colors,
+           autopct='%1.0f%%', startangle=90)
+    ax.axis('equal')
+    _save(fig, fname)
+
+
+def stackbar(fname, sources, labels, counts, colors, ratio=False, title=''):
+    """Draws a bar per source, stacking its counts[i] for each label.
+
+    If ratio is set the counts are fractions, and the y axis runs to 1.3
+    to leave room for the legend.
+    """
+
+    from matplotlib.figure import Figure
+    counts = np.asarray(counts, float).reshape(len(sources), len(labels))
+    fig = Figure()
+    ax = fig.add_subplot(111)
+    x = np.arange(len(sources))
+    bottom = np.zeros(len(sources))
+    for j, label in enumerate(labels):
+        ax.bar(x, counts[:, j], 1.0, bottom=bottom, color=colors[j],
+               edgecolor='black', label=label)
+        bottom += counts[:, j]
+    ax.set_xticks(x)
+    ax.set_xticklabels(sources, rotation=-45, ha='left')
+    ax.set_xlim(-0.5, len(sources) - 0.5)
+    if ratio:
+        ax.set_ylim(0, 1.3)
+    ax.legend(loc='upper left')
+    if title:
+        ax.set_title(title)
+    _save(fig, fname)
+
+
+def _render(job):
+    func, kwargs = job
+    func(**kwargs)
+    return kwargs['fname']
+
+
+def render_all(jobs, processes=None):
+    """Renders jobs, a list of (function, kwargs), in a process pool.
+
+    Returns the file names written.
+    """
+
+    if processes is None:
+        processes = min(len(jobs), multiprocessing.cpu_count())
+    if processes <= 1:
+        return map(_render, jobs)
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_render, jobs)
+    finally:
+        pool.close()
+        pool.join()
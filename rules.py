@@ -0,0 +1,184 @@
+"""Declarative URL rules compiled into one regular expression per test."""
+
+import hashlib
+import itertools
+import re
+import types
+
+
+def _any_of(substrings):
+    return '|'.join(re.escape(s) for s in substrings)
+
+
+def _trie(substrings):
+    """Returns a regex matching any of substrings, shaped as a trie.
+
+    Alternatives at each node start with different characters, so the
+    regex engine rejects all but one of them on their first character,
+    and a match attempt costs about the length of the longest
+    substring however many there are. Only whether some substring
+    occurs matters, so a branch ends at the first one on it.
+    """
+
+    root = {}
+    for s in substrings:
+        node = root
+        for ch in s:
+            node = node.setdefault(ch, {})
+        node[''] = None
+
+    def pattern(node):
+        if '' in node:
+            return ''
+        alts = [re.escape(ch) + pattern(child)
+                for ch, child in sorted(node.iteritems())]
+        if len(alts) == 1:
+            return alts[0]
+        return '(?:%s)' % '|'.join(alts)
+
+    return pattern(root)
+
+
+def _host_pattern(host):
+    """Translates a host pattern like '*.bbc.co.uk' to a regex."""
+
+    return r'\.'.join('[^/:.]+' if p == '*' else re.escape(p)
+                      for p in host.split('.'))
+
+
+class UrlRules(object):
+    """Decides which URLs a crawler may crawl and which are articles.
+
+    A URL may be crawled if it contains at least one of the allow
+    substrings (if any are given), none of the deny substrings and
+    its host matches one of the hosts patterns (if any are given),
+    where '*' matches a single host name label.
+
+    A URL is an article if it matches the article regex, contains
+    none of article_deny and ends with none of article_deny_suffix.
+
+    The host, allow and deny rules are compiled into a single regex,
+    and so are the article rules but for the suffixes. Substrings are
+    matched through trie-shaped alternations, so a test is one regex
+    match, in time about linear in the URL length and not growing
+    with the number of rules. Batches are filtered by
+    itertools.ifilter(), without a Python loop per URL.
+    """
+
+    def __init__(self, allow=(), deny=(), hosts=(), article=None,
+                 article_deny=(), article_deny_suffix=()):
+        if hasattr(article, 'pattern'):
+            article = article.pattern
+        self.allow = tuple(allow)
+        self.deny = tuple(deny)
+        self.hosts = tuple(hosts)
+        self.article = article
+        self.article_deny = tuple(article_deny)
+        self.article_deny_suffix = tuple(article_deny_suffix)
+
+        # lookaheads test the substrings anywhere, before the host
+        # pattern is matched at the start
+        crawl = ''
+        if self.deny:
+            crawl += '(?!.*?%s)' % _trie(self.deny)
+        if self.allow:
+            crawl += '(?=.*?%s)' % _trie(self.allow)
+        if self.hosts:
+            crawl += r'[a-zA-Z]+://(?:%s)(?:[:/?#]|$)' % (
+                '|'.join(_host_pattern(h) for h in self.hosts))
+        self._may_crawl = re.compile(crawl, re.S).match
+
+        self._is_article = None
+        if article is not None:
+            deny = ''
+            if self.article_deny:
+                deny = '(?!.*?%s)' % _trie(self.article_deny)
+            self._is_article = re.compile('%s(?:%s)' % (deny, article),
+                                          re.S).match
+
+    def article_spec(self):
+        """Returns a picklable description of the article rules."""
+
+        return {'article': self.article,
+                'article_deny': self.article_deny,
+                'article_deny_suffix': self.article_deny_suffix}
+
+    def may_crawl(self, url):
+        return self._may_crawl(url) is not None
+
+    def is_article(self, url):
+        if self._is_article is None or not self._is_article(url):
+            return False
+        return not url.endswith(self.article_deny_suffix)
+
+    def crawlable(self, urls):
+        """Returns the urls that may be crawled, in order."""
+
+        return list(itertools.ifilter(self._may_crawl, urls))
+
+    def articles(self, urls):
+        """Returns the urls that are articles, in order."""
+
+        if self._is_article is None:
+            return []
+        urls = list(itertools.ifilter(self._is_article, urls))
+        if self.article_deny_suffix:
+            suffix = self.article_deny_suffix
+            urls = [url for url in urls if not url.endswith(suffix)]
+        return urls
+
+
+def code_spec(func, *extra):
+    """Describes a hand-written rule function for refilter_scope().
+
+    The description changes whenever the function's code or any of
+    extra (e.g. the patterns of regexes it uses) changes.
+    """
+
+    h = hashlib.sha1()
+    _hash_code(h, getattr(func, 'im_func', func).func_code)
+    h.update(repr(extra))
+    return {'code': h.hexdigest()}
+
+
+def _hash_code(h, code):
+    """Hashes code, and the code of nested functions and lambdas.
+
+    The repr of a code object has its address, which differs between
+    runs, so nested code objects are hashed by their contents.
+    """
+
+    h.update(code.co_code)
+    h.update(repr(code.co_names))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(h, const)
+        else:
+            h.update(repr(const))
+
+
+def refilter_scope(old, new):
+    """Tells which stored articles must be re-checked after a rule change.
+
+    old and new are article specs as returned by article_spec() or
+    code_spec(), old is None if unknown. Returns None if no stored
+    article can have become a non-article, or else a predicate that
+    is true for every URL that may have.
+    """
+
+    if old == new:
+        return None
+    if old is None or 'code' in old or 'code' in new:
+        return lambda url: True
+    if old['article'] != new['article']:
+        return lambda url: True
+
+    # with the same article regex, only added deny rules can reject
+    # anything, and only URLs they match
+    deny = set(new['article_deny']) - set(old['article_deny'])
+    suffix = tuple(set(new['article_deny_suffix']) -
+                   set(old['article_deny_suffix']))
+    if not deny and not suffix:
+        return None
+    search = re.compile(_any_of(deny)).search if deny else lambda url: False
+    return lambda url: bool(search(url)) or url.endswith(suffix)
@@ -0,0 +1,162 @@
+"""Bootstrap confidence intervals and tests for the share of 'no' answers."""
+
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from classify import POLAR
+
+REPORT = 'betteridge_stats.json'
+RESAMPLES = 20000
+CONFIDENCE = 0.95
+
+
+def _normal_sf(z):
+    """Returns P(Z > z) for a standard normal Z."""
+
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def two_proportion_test(k1, n1, k2, n2):
+    """Returns (z, two-sided p-value) for k1/n1 and k2/n2 being equal."""
+
+    if not n1 or not n2:
+        return None, None
+    pooled = float(k1 + k2) / (n1 + n2)
+    se = math.sqrt(pooled * (1 - pooled) * (1.0 / n1 + 1.0 / n2))
+    if se == 0:
+        return 0.0, 1.0
+    z = (float(k1) / n1 - float(k2) / n2) / se
+    return z, 2 * _normal_sf(abs(z))
+
+
+def bootstrap(counts, resamples, rng):
+    """Resamples the answers of every source at once.
+
+    counts is a (sources, labels) array. Returns a (resamples,
+    sources, labels) array of counts, each row drawn with replacement
+    from the answers of its source: one binomial draw per label, over
+    all resamples and sources together, of the answers not yet drawn.
+    """
+
+    counts = np.asarray(counts, np.int64)
+    n = counts.sum(axis=1)
+    out = np.zeros((resamples,) + counts.shape, np.int64)
+    left = np.tile(n, (resamples, 1))
+    rest = n.astype(float)
+    for j in range(counts.shape[1] - 1):
+        p = np.where(rest > 0, counts[:, j] / np.maximum(rest, 1), 0)
+        out[:, :, j] = rng.binomial(left, np.clip(p, 0, 1))
+        left -= out[:, :, j]
+        rest -= counts[:, j]
+    out[:, :, -1] = left
+    return out
+
+
+def _summary(counts, samples, labels, alpha):
+    """Returns shares and bootstrap intervals for one row of counts."""
+
+    n = int(counts.sum())
+    totals = np.maximum(samples.sum(axis=-1), 1).astype(float)
+    out = {'n': n, 'counts': dict(zip(labels, counts.tolist()))}
+    for j, label in enumerate(labels):
+        shares = samples[:, j] / totals
+        lo, hi = np.percentile(shares, [100 * alpha / 2,
+                                        100 * (1 - alpha / 2)])
+        out[label] = {'share': float(counts[j]) / n if n else None,
+                      'low': float(lo) if n else None,
+                      'high': float(hi) if n else None}
+    return out
+
+
+def _verdict(summary):
+    if not summary['n']:
+        return 'no data'
+    if summary['no']['low'] > 0.5:
+        return 'no'
+    if summary['no']['high'] < 0.5:
+        return 'not no'
+    return 'undecided'
+
+
+def report(cube, resamples=RESAMPLES, confidence=CONFIDENCE, seed=0):
+    """Returns a dict of statistics of the polar answers in cube.
+
+    For every source and all of them together: the share of yes, no
+    and maybe among polar answers with bootstrap confidence intervals,
+    the bootstrap probability that no is not the majority answer, a
+    two-proportion test of its share of no against all other sources,
+    and a verdict on whether the answer is no.
+    """
+
+    polar = cube.select(POLAR)
+    labels = polar.labels
+    counts = polar.counts
+    alpha = 1 - confidence
+    rng = np.random.RandomState(seed)
+    samples = bootstrap(counts, resamples, rng)
+    # sources are resampled independently, so their sums resample all
+    overall = samples.sum(axis=1)
+    no = labels.index('no')
+
+    def row(c, s):
+        summary = _summary(c, s, labels, alpha)
+        shares = s[:, no] / np.maximum(s.sum(axis=-1), 1).astype(float)
+        summary['p_no_not_majority'] = float((shares <= 0.5).mean())
+        summary['verdict'] = _verdict(summary)
+        return summary
+
+    sources = {}
+    total = counts.sum(axis=0)
+    for i, source in enumerate(polar.sources):
+        summary = row(counts[i], samples[:, i])
+        z, p = two_proportion_test(counts[i, no], counts[i].sum(),
+                                   total[no] - counts[i, no],
+                                   total.sum() - counts[i].sum())
+        summary['vs_others'] = {'z': z, 'p': p}
+        sources[source] = summary
+
+    return {'labels': list(labels),
+            'resamples': resamples,
+            'confidence': confidence,
+            'seed': seed,
+            'non_polar': cube.totals().get('non-polar', 0),
+            'overall': row(total, overall),
+            'sources': sources}
+
+
+def content_key(cube, resamples, confidence, seed):
+    """Returns a hash of everything a report depends on."""
+
+    h = hashlib.sha1()
+    h.update(json.dumps([cube.sources, cube.labels, cube.counts.tolist(),
+                         resamples, confidence, seed]))
+    return h.hexdigest()
+
+
+def write_report(cube, fname=REPORT, resamples=RESAMPLES,
+                 confidence=CONFIDENCE, seed=0):
+    """Writes report() as JSON to fname, unless it's already there.
+
+    Returns the report.
+    """
+
+    key = content_key(cube, resamples, confidence, seed)
+    if os.path.exists(fname):
+        try:
+            with open(fname) as f:
+                old = json.load(f)
+            if old.get('key') == key:
+                return old
+        except ValueError:
+            pass
+
+    result = report(cube, resamples, confidence, seed)
+    result['key'] = key
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    os.rename(fname + '.tmp', fname)
+    return result
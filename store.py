@@ -0,0 +1,174 @@
+"""SQLite store of crawled articles, question headlines and answers."""
+
+import sqlite3
+
+FILENAME = 'headlines.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    title TEXT NOT NULL,
+    raw_title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    UNIQUE (source, url)
+);
+CREATE INDEX IF NOT EXISTS articles_title ON articles (source, title);
+
+CREATE TABLE IF NOT EXISTS headlines (
+    source TEXT NOT NULL,
+    title TEXT NOT NULL,
+    PRIMARY KEY (source, title)
+);
+
+CREATE TABLE IF NOT EXISTS answers (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    title TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    auto INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (source, title)
+);
+"""
+
+# Columns of the tables with a seq, which grows with every insert or
+# replace and is never reused, so rows changed since some seq can be
+# found
+COLUMNS = {'articles': ('seq', 'source', 'title', 'raw_title', 'url'),
+           'answers': ('seq', 'source', 'title', 'answer', 'auto')}
+
+
+def is_question(title):
+    return title.endswith('?')
+
+
+class HeadlineStore(object):
+    """Articles of all crawlers, their question headlines and answers.
+
+    A headline is a cleaned up article title ending in '?', and lives
+    as long as some article of its source has that title. Answers are
+    kept by source and title, even for headlines that are gone, and
+    are either given by hand or accepted guesses (auto).
+
+    The database is in WAL mode, so all crawler processes can write
+    to it while answer.py reads it.
+    """
+
+    def __init__(self, fname=FILENAME):
+        self.fname = fname
+        self.db = sqlite3.connect(fname, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        if 'auto' not in self._columns('answers'):
+            self.db.execute('ALTER TABLE answers ADD COLUMN '
+                            'auto INTEGER NOT NULL DEFAULT 0')
+        for table in COLUMNS:
+            if 'seq' not in self._columns(table):
+                self._add_seq(table)
+
+    def _columns(self, table):
+        return [row[1] for row in
+                self.db.execute('PRAGMA table_info(%s)' % table)]
+
+    def _add_seq(self, table):
+        """Rebuilds a table of an older store with a seq column."""
+
+        columns = ', '.join(c for c in COLUMNS[table] if c != 'seq')
+        self.db.executescript(
+            'BEGIN; '
+            'ALTER TABLE %(t)s RENAME TO old_%(t)s; '
+            'DROP INDEX IF EXISTS articles_title; '
+            '%(schema)s; '
+            'INSERT INTO %(t)s (%(c)s) SELECT %(c)s FROM old_%(t)s '
+            'ORDER BY rowid; '
+            'DROP TABLE old_%(t)s; '
+            'COMMIT;' % {'t': table, 'c': columns, 'schema': SCHEMA})
+
+    def close(self):
+        self.db.close()
+
+    def update(self, source, added=(), dropped=()):
+        """Adds and removes articles of source in one transaction.
+
+        added and dropped are sequences of (title, raw_title, url)
+        where title is the cleaned up title. Adding present articles
+        and dropping absent ones is harmless.
+        """
+
+        with self.db:
+            self.db.executemany(
+                'DELETE FROM articles WHERE source = ? AND url = ?',
+                [(source, url) for _, _, url in dropped])
+            self.db.executemany(
+                'DELETE FROM headlines WHERE source = ? AND title = ? AND '
+                'NOT EXISTS (SELECT 1 FROM articles '
+                'WHERE source = ? AND title = ?)',
+                [(source, title, source, title)
+                 for title, _, _ in dropped if is_question(title)])
+            self.db.executemany(
+                'INSERT OR REPLACE INTO articles '
+                '(source, title, raw_title, url) VALUES (?, ?, ?, ?)',
+                [(source, title, raw_title, url)
+                 for title, raw_title, url in added])
+            self.db.executemany(
+                'INSERT OR IGNORE INTO headlines VALUES (?, ?)',
+                [(source, title)
+                 for title, _, _ in added if is_question(title)])
+
+    def article_count(self, source=None):
+        if source is None:
+            return self.db.execute('SELECT COUNT(*) FROM articles'
+                                   ).fetchone()[0]
+        return self.db.execute('SELECT COUNT(*) FROM articles '
+                               'WHERE source = ?', (source,)).fetchone()[0]
+
+    def headlines(self):
+        """Returns a list of headline dicts with title, source and answer.
+
+        answer is left out of unanswered headlines, and auto is set for
+        accepted guesses.
+        """
+
+        rows = self.db.execute(
+            'SELECT h.source, h.title, a.answer, a.auto FROM headlines h '
+            'LEFT JOIN answers a ON a.source = h.source AND a.title = h.title')
+        headlines = []
+        for source, title, answer, auto in rows:
+            h = {'title': title, 'source': source}
+            if answer is not None:
+                h['answer'] = answer
+            if auto:
+                h['auto'] = True
+            headlines.append(h)
+        return headlines
+
+    def set_answers(self, answers):
+        """Stores answers, a sequence of (source, title, answer, auto)."""
+
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO answers (source, title, answer, auto) '
+                'VALUES (?, ?, ?, ?)', answers)
+
+    def answer_count(self):
+        return self.db.execute('SELECT COUNT(*) FROM answers').fetchone()[0]
+
+    def last_seq(self, table):
+        """Returns the highest seq of table, 'articles' or 'answers'."""
+
+        return self.db.execute('SELECT MAX(seq) FROM %s' % table
+                               ).fetchone()[0] or 0
+
+    def rows(self, table, since=0, until=None):
+        """Returns a cursor over the rows of table with since < seq <= until.
+
+        Rows are tuples of COLUMNS[table], ordered by source and seq.
+        """
+
+        if until is None:
+            until = self.last_seq(table)
+        return self.db.execute(
+            'SELECT %s FROM %s WHERE seq > ? AND seq <= ? '
+            'ORDER BY source, seq' % (', '.join(COLUMNS[table]), table),
+            (since, until))
@@ -0,0 +1,168 @@
+"""Memory-compact sets of URLs.
+
+Both sets only support add(), membership tests and len(); the URLs
+themselves are not kept and can't be iterated over.
+"""
+
+import array
+import hashlib
+import math
+import struct
+import sys
+
+
+def _hash128(url):
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    return struct.unpack('<QQ', hashlib.md5(url).digest())
+
+
+def fingerprint(url):
+    """Returns a non-zero 64 bit fingerprint of url."""
+
+    return _hash128(url)[0] or 1
+
+
+def deep_size(obj):
+    """Estimates the bytes used by a set, list or dict of strings."""
+
+    size = sys.getsizeof(obj)
+    for x in obj:
+        size += sys.getsizeof(x)
+    return size
+
+
+class FingerprintSet(object):
+    """Set of URL fingerprints in an open addressing hash table.
+
+    Each URL costs 8 to 32 bytes instead of a Python string and a
+    hash table entry. Distinct URLs collide with probability of about
+    n**2 / 2**65.
+    """
+
+    TYPECODE = 'L' if array.array('L').itemsize == 8 else 'Q'
+
+    def __init__(self, urls=(), capacity=1024):
+        self._len = 0
+        self._table = array.array(self.TYPECODE, [0]) * capacity
+        for url in urls:
+            self.add(url)
+
+    def __len__(self):
+        return self._len
+
+    def __getstate__(self):
+        return {'len': self._len, 'table': self._table.tostring()}
+
+    def __setstate__(self, state):
+        self._len = state['len']
+        self._table = array.array(self.TYPECODE)
+        self._table.fromstring(state['table'])
+
+    def _slot(self, table, fp):
+        """Returns the index of fp in table, or of the free slot for it."""
+
+        mask = len(table) - 1
+        i = fp & mask
+        while table[i] and table[i] != fp:
+            i = (i + 1) & mask
+        return i
+
+    def __contains__(self, url):
+        return bool(self._table[self._slot(self._table, fingerprint(url))])
+
+    def add(self, url):
+        fp = fingerprint(url)
+        i = self._slot(self._table, fp)
+        if self._table[i]:
+            return
+        self._table[i] = fp
+        self._len += 1
+        if self._len * 2 > len(self._table):
+            self._grow()
+
+    def _grow(self):
+        table = array.array(self.TYPECODE, [0]) * (len(self._table) * 2)
+        for fp in self._table:
+            if fp:
+                table[self._slot(table, fp)] = fp
+        self._table = table
+
+    def memory_usage(self):
+        """Returns the number of bytes used."""
+
+        return (sys.getsizeof(self) +
+                self._table.buffer_info()[1] * self._table.itemsize)
+
+
+class BloomFilter(object):
+    """Bloom filter holding capacity URLs at the given error rate."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.count = 0
+        nbits = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.nbits = max(nbits, 8)
+        self.nhashes = max(int(round(self.nbits * math.log(2) / capacity)), 1)
+        self.bits = bytearray((self.nbits + 7) // 8)
+
+    def _positions(self, h1, h2):
+        for i in range(self.nhashes):
+            yield (h1 + i * h2) % self.nbits
+
+    def contains(self, h1, h2):
+        bits = self.bits
+        for p in self._positions(h1, h2):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def add(self, h1, h2):
+        bits = self.bits
+        for p in self._positions(h1, h2):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter(object):
+    """Bloom filter that grows to hold any number of URLs.
+
+    When the current filter is full a new one with growth times the
+    capacity and a tightened error rate is added, so that the total
+    false positive rate stays below error_rate. False positives make
+    the crawler skip URLs it has never visited, never the reverse.
+    """
+
+    def __init__(self, urls=(), error_rate=0.001, capacity=100000,
+                 growth=2, tightening=0.5):
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self._filters = [BloomFilter(capacity, error_rate * (1 - tightening))]
+        for url in urls:
+            self.add(url)
+
+    def __len__(self):
+        return sum(f.count for f in self._filters)
+
+    def __contains__(self, url):
+        h1, h2 = _hash128(url)
+        return any(f.contains(h1, h2) for f in reversed(self._filters))
+
+    def add(self, url):
+        h1, h2 = _hash128(url)
+        if any(f.contains(h1, h2) for f in reversed(self._filters)):
+            return
+        last = self._filters[-1]
+        if last.count >= last.capacity:
+            err = (self.error_rate * (1 - self.tightening) *
+                   self.tightening ** len(self._filters))
+            last = BloomFilter(last.capacity * self.growth, err)
+            self._filters.append(last)
+        last.add(h1, h2)
+
+    def memory_usage(self):
+        """Returns the number of bytes used."""
+
+        return sys.getsizeof(self) + sum(sys.getsizeof(f.bits)
+                                         for f in self._filters)